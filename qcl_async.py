@@ -0,0 +1,288 @@
+# -*- coding: UTF8 -*-
+
+"""qcl_async.py provides an asyncio interface to control the QCL.
+
+qcl_async.py
+============
+
+Provides the AsyncQCL class, an asyncio counterpart of the QCL class in qcl_controller.py. All functions, which communicate with the
+laser, are coroutines. Therefore a single event loop can control the laser together with other devices (e.g. detectors) without
+blocking reads or additional threads.
+
+The serial port is opened using the pyserial-asyncio package (import name serial_asyncio).
+"""
+__author__ = "Arne Küderle"
+__copyright__ = "Copyright 2015, Arne Küderle"
+__version__ = "1.0"
+__maintainer__ = "Arne Küderle"
+__email__ = "a.kuederle@gmail.com"
+
+import asyncio
+from collections import deque
+from time import monotonic, time
+
+from qcl_controller import QCL, QCLError, QCLTimeoutError
+
+
+class AsyncQCL(object):
+
+    """asyncio version of the QCL class.
+
+    The class provides the same get/set functions, Get/Set containers and Stat tuple as the QCL class, but every function that
+    communicates with the laser has to be awaited. Because the connection is opened asynchronously, instances are created with the
+    open() coroutine instead of calling the class directly.
+
+    Usage example
+    =============
+
+        >>> qcl = await AsyncQCL.open("/dev/ttyUSB0")
+        >>> await qcl.set_wn(1080)
+        >>> await qcl.scan_start()
+        >>> await qcl.wait_for_finish()
+        >>> qcl.close()
+
+    Implementation details
+    ======================
+
+    Commands are written to the transport without waiting for previous answers. For each query a future is appended to a queue
+    of pending answers. A single reader task reads the answers line by line and resolves the pending futures in the order the
+    queries were send. Since the write and the queueing of the future happen without giving control back to the event loop,
+    every answer is matched to the right query, even if multiple coroutines use the laser at the same time.
+    If an answer does not arrive within timeout seconds (or can not be parsed), all pending queries fail, new commands are held back and
+    the received data is discarded, until no data was received for a short time. So a lost answer is never handed to a later query.
+    """
+
+    _control = QCL._control
+    _state = QCL._state
+    _query = QCL._query
+    _Registry = QCL._Registry
+    _Queries = QCL._Queries
+    _Commands = QCL._Commands
+    _Modes = QCL._Modes
+
+    _log_write = QCL._log_write
+    save_log = QCL.save_log
+    log_to = QCL.log_to
+    close_log = QCL.close_log
+    _query_allowed = QCL._query_allowed
+
+    def __init__(self, reader, writer, log=False, timeout=1.0):
+        super(AsyncQCL, self).__init__()
+        self._reader = reader
+        self._writer = writer
+        self.timeout = timeout           # time in seconds to wait for an answer
+        self.log = log
+        self.log_file = deque(maxlen=100000)
+        self._log_sink = None
+        self.session = None
+        self._clock_offset = time() - monotonic()
+        self._pending = deque()          # futures of queries, which are still waiting for their answer
+        self._received = monotonic()     # time of the last received answer
+        self._synced = asyncio.Event()   # cleared, while the received data is discarded (see _resync)
+        self._synced.set()
+        self._Range = QCL._Range
+        self.Set = self._control(interval=self.set_interval, **dict((command.name, getattr(self, "set_" + command.name)) for command in self._Registry if command.set is not None))
+        self.Get = self._query(all=self.get_all, **dict((command.name, getattr(self, "get_" + command.name)) for command in self._Registry))
+        self.Stat = self._state(wn=None, freq=None, pw=None, startwn=None, stopwn=None, rate=None, cycles=None, mode=None, pause=None, step=None, whours=None, scancount=None, interval=3, awn=None)
+        self._reader_task = asyncio.ensure_future(self._read_answers())
+
+    @classmethod
+    async def open(cls, port, log=False, getall=True):
+        """open the serial port and return a new AsyncQCL instance."""
+        import serial_asyncio
+        reader, writer = await serial_asyncio.open_serial_connection(url=port, baudrate=115200)
+        qcl = cls(reader, writer, log=log)
+        if getall is True:
+            await qcl.get_all()
+        return qcl
+
+    async def _read_answers(self):
+        """reader task, which hands every received answer to the oldest pending query."""
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                self._received = monotonic()
+                answer = line.decode("ascii", "replace")
+                self._log_write(answer, mode="read")
+                if self._pending:
+                    future = self._pending.popleft()
+                    if not future.done():
+                        future.set_result(answer)
+        finally:
+            while self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(ConnectionError("connection to the laser was closed"))
+
+    def _write(self, command, answers=0):
+        """send a command string and return futures for the given number of expected answers."""
+        loop = asyncio.get_event_loop()
+        futures = [loop.create_future() for _ in range(answers)]
+        self._log_write(command, mode="write")
+        self._writer.write(command.encode("ascii"))
+        self._pending.extend(futures)
+        return futures
+
+    async def _send(self, command, answers=0):
+        """wait for a running resynchronisation and send a command (see _write)."""
+        await self._synced.wait()
+        return self._write(command, answers)
+
+    async def _answers(self, command, futures):
+        """wait for the answers of a command and resynchronise, if they do not arrive in time."""
+        try:
+            return await asyncio.wait_for(asyncio.gather(*futures), self.timeout)
+        except asyncio.TimeoutError:
+            await self._resync()
+            raise QCLTimeoutError("no answer to {!r} within {} s".format(command, self.timeout))
+
+    async def _resync(self, quiet=0.01, limit=0.2):
+        """fail all pending queries and discard received data, until no data was received for quiet seconds (at most limit seconds).
+
+        Late answers of a failed query would otherwise be handed to the following queries.
+        """
+        self._synced.clear()
+        try:
+            while self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(QCLTimeoutError("the answer was discarded to resynchronise the connection"))
+            end = monotonic() + limit
+            await asyncio.sleep(quiet)
+            while monotonic() - self._received < quiet and monotonic() < end:
+                await asyncio.sleep(quiet)
+        finally:
+            self._synced.set()
+
+    async def _get(self, name):
+        """query a single parameter using the _Queries table and store its value in the Stat tuple."""
+        command, parse = getattr(self._Queries, name)
+        answer, = await self._answers(command, await self._send(command, answers=1))
+        try:
+            rlvalue = parse(answer)
+        except QCLError:
+            await self._resync()
+            raise
+        self.Stat = self.Stat._replace(**{name: rlvalue})
+        return rlvalue
+
+    async def _set(self, name, command, value):
+        """check the range of a value, send the set command and verify the result with the respective get function."""
+        if float(value) < getattr(self._Range, name)[0] or float(value) > getattr(self._Range, name)[1]:
+            raise ValueError("{} is out of range!".format(str(value)))
+        await self._send(command.format(value))
+        return await self._get(name)
+
+    async def set_interval(self, value):
+        """set the interval time for a manual step scan (see QCL.set_interval)."""
+        if float(value) < self._Range.interval[0] or float(value) > self._Range.interval[1]:
+            raise ValueError("{} is out of range!".format(str(value)))
+        self.Stat = self.Stat._replace(interval=float(value))
+        return value
+
+    async def get_batch(self, names):
+        """get multiple parameters with a single write (see QCL.get_batch)."""
+        names = [name for name in names if self._query_allowed(name)]
+        if not names:
+            return {}
+        command = "".join(getattr(self._Queries, name)[0] for name in names)
+        answers = await self._answers(command, await self._send(command, answers=len(names)))
+        values = {}
+        try:
+            for name, answer in zip(names, answers):
+                values[name] = getattr(self._Queries, name)[1](answer)
+        except QCLError:
+            await self._resync()
+            raise
+        self.Stat = self.Stat._replace(**values)
+        return values
+
+    async def get_all(self):
+        """get the full current laser state (see QCL.get_all)."""
+        await self.get_batch([name for name in self._query._fields[:-1] if name not in ("pause", "step")])
+        await self.get_batch(["pause", "step"])
+        return self.Stat
+
+    async def scan_start(self):
+        """send start command."""
+        await self._send(":scan:run 1\n")
+        await self._writer.drain()
+
+    async def scan_stop(self):
+        """send stop command."""
+        await self._send(":scan:run 0\n")
+        await self._writer.drain()
+
+    async def step_next(self):
+        """jump to the next wavenumber in manual stepscan."""
+        await self._send(":scan:step:next\n")
+        await self._writer.drain()
+
+    def close(self):
+        """close the port and stop the reader task."""
+        self._writer.close()
+        self._reader_task.cancel()
+        self.close_log()
+
+    async def wait_for_finish(self, interval=3.0):
+        """wait until the current scans are finished.
+
+        Works like the synchronous mode of QCL.wait_for_finish. To wait in the background, the coroutine can simply be wrapped in a task:
+
+            >>> await qcl.scan_start()
+            >>> task = asyncio.ensure_future(qcl.wait_for_finish())
+        """
+        await asyncio.sleep(3)  # prevent issues, when the function is called directly after the scan-start function
+        while True:
+            await self.get_scancount()
+            if self.Stat.scancount == 0:
+                break
+            await asyncio.sleep(interval)
+
+    async def man_scan(self):
+        """run a semi-automatic stepscan with the next commands at fixed deadlines (see QCL.man_scan)."""
+        interval = self.Stat.interval
+        await self.scan_start()
+        start = monotonic()
+        step = 1
+        while True:
+            await asyncio.sleep(max(start + step * interval - monotonic(), 0.0))
+            await self.get_batch(["scancount", "awn"])
+            if self.Stat.scancount == 0:
+                break
+            await self.step_next()
+            if await self.get_scancount() == 0:     # the next command after the last wavenumber ends the scan
+                break
+            step += 1
+
+
+def _getter(command):
+    """create the coroutine function to get a parameter of the QCL registry."""
+    name = command.name
+
+    async def get(self):
+        if self._query_allowed(name):
+            return await self._get(name)
+    get.__name__ = "get_" + name
+    get.__doc__ = command.get_doc
+    return get
+
+
+def _setter(command):
+    """create the coroutine function to set a parameter of the QCL registry."""
+    name = command.name
+
+    async def set(self, value):
+        if self._query_allowed(name):
+            return await self._set(name, command.set, int(value) if name == "mode" else value)
+    set.__name__ = "set_" + name
+    set.__doc__ = command.set_doc
+    return set
+
+
+for _entry in QCL._Registry:
+    setattr(AsyncQCL, "get_" + _entry.name, _getter(_entry))
+    if _entry.set is not None:
+        setattr(AsyncQCL, "set_" + _entry.name, _setter(_entry))
@@ -0,0 +1,182 @@
+# -*- coding: UTF8 -*-
+
+"""qcl_benchmark.py measures the performance of the QCL command path using the simulated laser.
+
+qcl_benchmark.py
+================
+
+The benchmarks run the QCL class against a SimulatedLaser (see qcl_simulator.py), so no laser controller is needed. They can be started from
+the command line:
+
+    $ python qcl_benchmark.py                     # all benchmarks with the default latency of the simulated controller
+    $ python qcl_benchmark.py --latency 0.01      # simulate a slower controller
+    $ python qcl_benchmark.py --pty               # communicate over a pseudo terminal instead of the in-process transport (needs pyserial)
+    $ python qcl_benchmark.py --skip-scans --json results.json
+    $ python qcl_benchmark.py --max get_all=40 --max get_single=8 --max man_scan.error=50
+
+For each benchmark the number of runs and the mean, median, 95th percentile and maximum duration in milliseconds are reported. The scan
+benchmarks additionally report the time between the end of a scan and the return of wait_for_finish, and the timing error of man_scan.
+Limits for the mean (or any other reported value) of a benchmark can be given with --max. If a limit is exceeded, the exit code is 1, so
+the benchmarks can be used to catch performance regressions in a CI job.
+"""
+__author__ = "Arne Küderle"
+__copyright__ = "Copyright 2015, Arne Küderle"
+__version__ = "1.0"
+__maintainer__ = "Arne Küderle"
+__email__ = "a.kuederle@gmail.com"
+
+from time import perf_counter, sleep
+
+from qcl_controller import QCL
+from qcl_simulator import PtyServer, SimulatedLaser, SimulatedSerial
+
+
+def _statistics(durations):
+    """return mean, median, 95th percentile and maximum of a list of durations in milliseconds."""
+    durations = sorted(duration * 1000.0 for duration in durations)
+    return dict(runs=len(durations), mean=sum(durations) / len(durations), median=durations[len(durations) // 2],
+                p95=durations[min(len(durations) - 1, int(0.95 * len(durations)))], max=durations[-1])
+
+
+def _measure(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        durations.append(perf_counter() - start)
+    return _statistics(durations)
+
+
+def bench_get_all(qcl, repeat):
+    """full refresh of the laser state with get_all."""
+    return _measure(qcl.get_all, repeat)
+
+
+def bench_get_sequential(qcl, repeat):
+    """full refresh of the laser state with one get function per parameter."""
+    def refresh():
+        for get in qcl.Get[:-1]:
+            get()
+    return _measure(refresh, repeat)
+
+
+def bench_get_single(qcl, repeat):
+    """single query of the real wavenumber."""
+    return _measure(qcl.get_awn, repeat)
+
+
+def bench_set_verify(qcl, repeat):
+    """setting the scan parameters one by one with set and verify."""
+    values = [(1000.0, 1200.0, 2.0), (1010.0, 1210.0, 3.0)]
+
+    def configure(counter=[0]):
+        startwn, stopwn, rate = values[counter[0] % 2]
+        counter[0] += 1
+        qcl.set_startwn(startwn)
+        qcl.set_stopwn(stopwn)
+        qcl.set_rate(rate)
+    return _measure(configure, repeat)
+
+
+def bench_recipe(qcl, repeat):
+    """switching between two scan recipes with apply_recipe."""
+    recipes = [qcl.recipe(startwn=1000, stopwn=1200, rate=2), qcl.recipe(startwn=1010, stopwn=1210, rate=3)]
+
+    def switch(counter=[0]):
+        qcl.apply_recipe(recipes[counter[0] % 2])
+        counter[0] += 1
+    return _measure(switch, repeat)
+
+
+def bench_wait_for_finish(qcl, laser, interval=0.5):
+    """time between the end of a short sweep and the return of wait_for_finish."""
+    qcl.apply_recipe(qcl.recipe(mode=3, startwn=1000, stopwn=1100, rate=2, cycles=1))
+    scan_time = 100.0 / (2 * laser.rate_scale)
+    start = perf_counter()
+    qcl.scan_start()
+    qcl.wait_for_finish(interval=interval)
+    total = perf_counter() - start
+    return dict(_statistics([total]), scan_time=scan_time * 1000.0, overhead=(total - scan_time) * 1000.0)
+
+
+def bench_man_scan(qcl, interval=1.0):
+    """timing error of a semi-manual stepscan with man_scan."""
+    qcl.apply_recipe(qcl.recipe(mode=2, startwn=1000, stopwn=1100, step=25, cycles=1))
+    qcl.set_interval(interval)
+    timing = qcl.man_scan(asynchron=False)
+    expected = (int(100 / 25) + 1) * interval
+    return dict(_statistics([timing.duration]), expected=expected * 1000.0, error=(timing.duration - expected) * 1000.0,
+                jitter_mean=timing.jitter_mean * 1000.0, jitter_max=timing.jitter_max * 1000.0)
+
+
+def run(latency=0.002, repeat=50, pty=False, scans=True):
+    """run all benchmarks and return the results as a dictionary."""
+    laser = SimulatedLaser(rate_scale=20.0)
+    server = None
+    if pty is True:
+        server = PtyServer(laser, latency=latency)
+        qcl = QCL(port=server.port)
+    else:
+        qcl = QCL(transport=SimulatedSerial(laser, latency=latency))
+    results = {}
+    try:
+        results["get_all"] = bench_get_all(qcl, repeat)
+        results["get_sequential"] = bench_get_sequential(qcl, repeat)
+        results["get_single"] = bench_get_single(qcl, repeat)
+        results["set_verify"] = bench_set_verify(qcl, repeat)
+        results["recipe"] = bench_recipe(qcl, repeat)
+        if scans is True:
+            sleep(0.1)
+            results["wait_for_finish"] = bench_wait_for_finish(qcl, laser)
+            results["man_scan"] = bench_man_scan(qcl)
+    finally:
+        qcl.close()
+        if server is not None:
+            server.close()
+    return results
+
+
+def main(argv=None):
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description="Benchmark the QCL command path against a simulated laser.")
+    parser.add_argument("--latency", type=float, default=0.002, help="answer latency of the simulated controller in seconds")
+    parser.add_argument("--repeat", type=int, default=50, help="number of runs of each command benchmark")
+    parser.add_argument("--pty", action="store_true", help="use a pseudo terminal instead of the in-process transport")
+    parser.add_argument("--skip-scans", action="store_true", help="skip the wait_for_finish and man_scan benchmarks")
+    parser.add_argument("--json", metavar="FILE", help="write the results to a JSON file")
+    parser.add_argument("--max", action="append", default=[], metavar="NAME[.VALUE]=MS",
+                        help="limit in milliseconds for the mean (or the given value) of a benchmark, e.g. get_all=40 or man_scan.error=50")
+    args = parser.parse_args(argv)
+    limits = []
+    for limit in args.max:
+        key, _, value = limit.partition("=")
+        name, _, field = key.partition(".")
+        try:
+            limits.append((name, field or "mean", float(value)))
+        except ValueError:
+            parser.error("invalid limit {!r}".format(limit))
+    results = run(latency=args.latency, repeat=args.repeat, pty=args.pty, scans=not args.skip_scans)
+    print("{:<16} {:>5} {:>10} {:>10} {:>10} {:>10}".format("benchmark [ms]", "runs", "mean", "median", "p95", "max"))
+    for name, result in results.items():
+        print("{:<16} {runs:>5} {mean:>10.3f} {median:>10.3f} {p95:>10.3f} {max:>10.3f}".format(name, **result))
+        extra = ", ".join("{}={:.3f}".format(key, value) for key, value in result.items() if key not in ("runs", "mean", "median", "p95", "max"))
+        if extra:
+            print("{:<16} {}".format("", extra))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    failures = 0
+    for name, field, limit in limits:
+        if name not in results:
+            continue                     # benchmark skipped
+        value = results[name].get(field)
+        if value is None or value > limit:
+            print("FAILED: {}.{} = {} ms exceeds the limit of {} ms".format(name, field, value, limit))
+            failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -11,12 +11,244 @@ Provides:
 
 The documentation of the QCL serial interface can be found in its manual, available with the procduct or on the official website.
 """
-__author__ = "Arne Kderle"
-__copyright__ = "Copyright 2015, Arne Kderle"
+__author__ = "Arne Küderle"
+__copyright__ = "Copyright 2015, Arne Küderle"
 __version__ = "1.0"
-__maintainer__ = "Arne Kderle"
+__maintainer__ = "Arne Küderle"
 __email__ = "a.kuederle@gmail.com"
 
+import json
+import os
+import re
+from collections import deque
+from time import monotonic, perf_counter, time
+
+_number = re.compile(r"\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+
+
+class QCLError(Exception):
+    """base class of the errors of the communication with the laser."""
+
+
+class QCLTimeoutError(QCLError, TimeoutError):
+    """the laser did not answer a command before its deadline."""
+
+
+class QCLParseError(QCLError, ValueError):
+    """an answer of the laser does not have the expected format (a ValueError for compatibility)."""
+
+
+def _parse_float(answer):
+    """convert an answer of the laser (value followed by unit and line end) into a float."""
+    match = _number.match(answer)
+    if match is None:
+        raise QCLParseError("could not parse answer {!r}".format(answer))
+    return float(match.group(1))
+
+
+# complete answer of a query: a single value, an optional unit (letters, optionally followed by an exponent like in cm-1) and the line end
+_frame = re.compile(r"\s*[-+]?(?:\d+\.?\d*|\.\d+)\s*(?:[^\W\d_]+(?:\^?-?\d)?)?\s*\n\Z")
+
+
+def _parse_int(answer):
+    """convert an answer of the laser (value followed by unit and line end) into an integer."""
+    return int(_parse_float(answer))
+
+
+class _LogWriter(object):
+
+    """background thread, which appends log entries to a rotating JSON lines file."""
+
+    def __init__(self, file, clock_offset, max_bytes, backups):
+        from queue import SimpleQueue
+        from threading import Thread
+        self.file = file
+        self.clock_offset = clock_offset
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue = SimpleQueue()
+        self._thread = Thread(target=self._run, name="qcl-log-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, entry):
+        self._queue.put(entry)
+
+    def close(self):
+        """write all remaining entries and stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _rotate(self):
+        for number in range(self.backups - 1, 0, -1):
+            if os.path.exists("{}.{}".format(self.file, number)):
+                os.replace("{}.{}".format(self.file, number), "{}.{}".format(self.file, number + 1))
+        if self.backups > 0:
+            os.replace(self.file, self.file + ".1")
+        else:
+            os.remove(self.file)
+
+    def _run(self):
+        f = open(self.file, "a")
+        try:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    break
+                msg, timestamp = entry
+                f.write(json.dumps({"time": timestamp + self.clock_offset, "monotonic": timestamp, "msg": msg}) + "\n")
+                if self._queue.empty():
+                    f.flush()
+                    if f.tell() >= self.max_bytes:
+                        f.close()
+                        self._rotate()
+                        f = open(self.file, "a")
+        finally:
+            f.close()
+
+
+def _command_key(command):
+    """name of a command in the metrics (the command without its value, or "batch" for multiple commands)."""
+    if command.count("\n") > 1:
+        return "batch"
+    return command.split(" ", 1)[0].rstrip("\n")
+
+
+class Metrics(object):
+
+    """Collects statistics about the communication with the laser.
+
+    For each command (without its value) the number of calls, the total time, a latency histogram, the number of timeouts, parse failures and
+    retries, and the number of send and received bytes are counted. Resynchronisations of the receive buffer are recorded as "resync". Multiple commands send in a single write (see QCL.get_batch) are counted as "batch".
+    Set functions additionally record the total time of the set command and its verification under the name of the command followed by "+verify".
+
+        >>> qcl.metrics.snapshot()[":laser:pos?"]
+        {'count': 120, 'time': 0.61, 'timeouts': 0, 'parse_failures': 0, 'retries': 0, 'bytes_out': 1440, 'bytes_in': 1560, 'histogram': {0.001: 0, 0.002: 0, 0.005: 0, 0.01: 120, ...}}
+        >>> print(qcl.metrics.prometheus())
+    """
+
+    # upper bounds in seconds of the latency histogram buckets
+    buckets = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, float("inf"))
+
+    def __init__(self):
+        from threading import Lock
+        self._lock = Lock()
+        self._commands = {}
+
+    def _entry(self, key):
+        entry = self._commands.get(key)
+        if entry is None:
+            entry = self._commands[key] = dict(count=0, time=0.0, timeouts=0, parse_failures=0, retries=0, bytes_out=0, bytes_in=0, histogram=[0] * len(self.buckets))
+        return entry
+
+    def record(self, key, seconds, bytes_out=0, bytes_in=0, timeout=False):
+        """add a single call of a command."""
+        from bisect import bisect_left
+        with self._lock:
+            entry = self._entry(key)
+            entry["count"] += 1
+            entry["time"] += seconds
+            entry["bytes_out"] += bytes_out
+            entry["bytes_in"] += bytes_in
+            entry["timeouts"] += timeout
+            entry["histogram"][bisect_left(self.buckets, seconds)] += 1
+
+    def parse_failure(self, key):
+        """count an answer of a command, which could not be parsed."""
+        with self._lock:
+            self._entry(key)["parse_failures"] += 1
+
+    def retry(self, key):
+        """count a repeated query of a command."""
+        with self._lock:
+            self._entry(key)["retries"] += 1
+
+    def reset(self):
+        """remove all collected statistics."""
+        with self._lock:
+            self._commands = {}
+
+    def snapshot(self):
+        """return a copy of the statistics of all commands as a dictionary."""
+        with self._lock:
+            snapshot = {}
+            for key, entry in self._commands.items():
+                snapshot[key] = dict(entry, histogram=dict(zip(self.buckets, entry["histogram"])))
+            return snapshot
+
+    def prometheus(self, prefix="qcl"):
+        """return the statistics in the Prometheus text exposition format."""
+        lines = []
+        snapshot = self.snapshot()
+        for name, kind, help_text in (("requests_total", "counter", "number of commands send to the laser"), ("timeouts_total", "counter", "number of answers not received before the port timeout"),
+                                      ("parse_failures_total", "counter", "number of answers which could not be parsed"), ("retries_total", "counter", "number of repeated queries"),
+                                      ("bytes_sent_total", "counter", "number of bytes send to the laser"),
+                                      ("bytes_received_total", "counter", "number of bytes received from the laser"), ("latency_seconds", "histogram", "latency of the commands")):
+            lines.append("# HELP {}_{} {}".format(prefix, name, help_text))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+            for key, entry in sorted(snapshot.items()):
+                label = 'command="{}"'.format(key.replace("\\", "\\\\").replace('"', '\\"'))
+                if kind == "counter":
+                    field = dict(requests_total="count", timeouts_total="timeouts", parse_failures_total="parse_failures", retries_total="retries", bytes_sent_total="bytes_out",
+                                 bytes_received_total="bytes_in")[name]
+                    lines.append("{}_{}{{{}}} {}".format(prefix, name, label, entry[field]))
+                    continue
+                cumulative = 0
+                for bound in self.buckets:
+                    cumulative += entry["histogram"][bound]
+                    lines.append('{}_{}_bucket{{{},le="{}"}} {}'.format(prefix, name, label, "+Inf" if bound == float("inf") else bound, cumulative))
+                lines.append("{}_{}_sum{{{}}} {}".format(prefix, name, label, entry["time"]))
+                lines.append("{}_{}_count{{{}}} {}".format(prefix, name, label, entry["count"]))
+        return "\n".join(lines) + "\n"
+
+
+def _getter(command):
+    """create the get function of a command of the QCL registry."""
+    name = command.name
+    if command.modes is None:
+        def get(self):
+            return self._get(name)
+    else:
+        def get(self):
+            if self._query_allowed(name):
+                return self._get(name)
+    get.__name__ = "get_" + name
+    get.__doc__ = command.get_doc + ("\n\n        unit: {}\n        ".format(command.unit) if command.unit else "")
+    return get
+
+
+def _setter(command):
+    """create the set function of a command of the QCL registry."""
+    name = command.name
+    form = command.set.format
+    convert = int if command.parse is _parse_int else str
+
+    def set(self, value):
+        if not self._query_allowed(name):
+            return None
+        low, high = getattr(self._Range, name)
+        if float(value) < low or float(value) > high:
+            raise ValueError("{} is out of range!".format(str(value)))
+        return self._set(name, form(convert(value)), value)
+    set.__name__ = "set_" + name
+    set.__doc__ = command.set_doc
+    return set
+
+
+def _state_file(port):
+    """default file to persist the laser state of a port."""
+    name = re.sub(r"[^\w.-]+", "_", str(port)).strip("_") or "port"
+    return os.path.join(os.path.expanduser("~"), ".cache", "qcl_controller", name + ".json")
+
+
+def _same(value, other, decimals=None):
+    """check if two parameter values are equal at the resolution of the laser (decimals, see the _Registry) or apart from floating point errors."""
+    if value is None or other is None:
+        return False
+    if decimals is not None:
+        return round(value, decimals) == round(other, decimals)
+    return abs(value - other) <= 1e-6 * max(1.0, abs(other))
+
 
 class QCL(object):
 
@@ -75,6 +307,7 @@ class QCL(object):
     scan_stop  : abort scans
     scan_next  : jumps to next wavenumber (only available in manual scanmode)
     close      : closes the communication port to the laser (should be used at the end of each session)
+    get_batch  : queries several parameters with a single write
 
     Beside simple wrapper functions for laser functionality, the class provides a handful of other useful functions:
 
@@ -82,24 +315,55 @@ class QCL(object):
     =============================
     wait_for_finish : periodically reports the status of a running scan
     man_scan        : a semi-manual implementation of the manual scanmode, which can be used to perform manual scan with a given overall scan time
+    tune            : sets the wavenumber and waits, until the laser has settled at the new wavenumber
+    list_scan       : visits an arbitrary list of wavenumbers in an optimized order and stays for a given time at each wavenumber
     save_log        : saves the collected log data of the session in a file
+    log_to          : streams the log data to a rotating file in a background thread
+    record          : records an exact transcript of the communication, which can be replayed with the qcl_replay module
+    store_to        : appends all commands, answers and Stat updates to a memory-mapped session store (see qcl_session)
+    cached          : returns a parameter from the Stat tuple or queries it, if the stored value is outdated
+    refresh         : queries all outdated parameters
+    verify          : checks all values, which were set in trusted mode
+    recipe          : creates a validated set of scan parameters
+    apply_recipe    : sends all parameters of a recipe, which differ from the current laser state, in a single write
 
     Implementation details
     ======================
 
+    Command registry
+    All laser parameters are described by a single table, the _Registry. Each entry contains the query command, the parser and unit of the answer,
+    the set command, the valid range, the resolution of the laser and the scanmodes in which the parameter is available. The _Queries, _Commands and _Range tables as well as all
+    get_* and set_* functions (except set_interval) are generated from this table, so a new parameter only needs a new entry.
+
     Set-function
     Before a command is send to the laser, it is checked, if the given value is valid for the respective parameter. This is done using the range
     information stored in the _Range namedtuple, which contains the upper and the lower limit for each parameter.
     A Set-function then sends the given parameter to the laser. Right after this command the corresponding Get-function is called
     to check if the laser has successfully set the parameter to its new value. The new value is returned to the user.
+    If the trusted parameter is set to True, the Get-function is skipped and the given value is written to the Stat tuple directly. All values
+    set in this mode can be checked later on with a single call of the verify() function.
 
     Get-function
     The Get functions simple send a query to the laser. The laser than returns the value of the queried parameter. Since the returned answer contains additional characters beside the poor value
-    the answer string is cut respectively and converted in an integer or float format depending of the parameter. Beside returning the value, the value is also writte to the Stat tuple.
+    the answer string is parsed and converted in an integer or float format depending of the parameter (see the _Queries table). Beside returning the value, the value is also writte to the Stat tuple.
+    Answers are read line by line from an internal receive buffer, so a query returns as soon as the complete answer has arrived.
 
     Stat-tuple
     The Stat namedtuple contains all current known parameter values of the laser. Please note, that this values might not reflected the real laser state, since the values of the tuple are only updated,
     if the respective value is queried from the laser by one of the provided Get functions. To refresh all parameter values the get_all() function can be used.
+    With getall="lazy" on initialisation, the values are not queried at once. Instead each value of the Stat tuple is queried on its first access.
+    With persist=True, the known laser state is saved to a file for the port on close() and restored on the next initialisation, if the working hours
+    and the wavenumber of the laser did not change (see save_state and load_state). Only the remaining values are queried then.
+
+        >>> qcl = QCL(getall="lazy", persist=True)
+
+    The cached() and refresh() functions only query values, which are older than their time to live (defined in seconds for each parameter by the TTL tuple).
+
+    Timeline
+    If a ScanTimeline (see qcl_telemetry) is assigned to the timeline attribute, every real wavenumber received from the laser and the time of every
+    scan start, step and scan end are recorded in it. The timeline maps the timestamps of detector samples to the emitted wavenumbers.
+
+        >>> qcl.timeline = ScanTimeline()
 
     Logging
     To log and debug the laser communication, all traffic between this controller and the laser can be recorded. To activate logging, the log parameter has to be set to True. This can
@@ -112,277 +376,513 @@ class QCL(object):
         >>> qcl = QCL()
         >>> qcl.log = True
 
-    If logging is enabled, all strings, send to or received from the laser, are stored (with respective formatting for incoming and outgoing communication) as a new element of the log_file list variable.
+    If logging is enabled, all strings, send to or received from the laser, are stored (with respective formatting for incoming and outgoing communication) together with a monotonic
+    timestamp as a new element of the log_file ring. The ring keeps the last log_size entries (parameter on initialisation), so long sessions do not run out of memory.
     To save all logs of session to a file the save_log() function can be used. Please note, that this will clear the log_file variable after saving.
+    For long sessions, the log can be streamed to a rotating JSON lines file by a background thread using the log_to() function.
+    For unattended runs over days, store_to() appends all log entries and every update of the Stat tuple to an append-only session store with
+    fixed-width, memory-mapped columns, which can be read by another process during the session (see the qcl_session module).
+
+    Metrics
+    Every command send to the laser is timed. The number of calls, latency histograms, timeouts, parse failures and transferred bytes of each command
+    are collected in the metrics attribute (see the Metrics class). They can be read with qcl.metrics.snapshot() or exported with qcl.metrics.prometheus().
+
+    Errors and timeouts
+    All answers of a command must arrive before its deadline: timeout seconds after the command was send (deviating values for single commands can be
+    set in the timeouts dictionary). Otherwise a QCLTimeoutError is raised. To keep the deadlines, the read timeout of the port (or of a transport with
+    a timeout attribute) is set to 10 ms. Answers, which do not consist of a value, an optional unit and the line end, raise a QCLParseError (which is also a ValueError). In both cases the receive buffer is resynchronised before the next command, so late
+    or remaining data of the failed command is never read as answer of another command. Queries do not change the laser state and are therefore
+    repeated up to retries times with an exponential backoff, before the error is raised. Both errors are derived from QCLError.
+
+        >>> qcl.timeouts[":info:hhrs?"] = 2.0
+
+    Transport
+    Instead of opening a serial port, any object providing the write(), read(), in_waiting and close() members of a serial.Serial object can be passed
+    as transport. This is used to run the class against the simulated laser of the qcl_simulator module.
+
+        >>> from qcl_simulator import SimulatedSerial
+        >>> qcl = QCL(transport=SimulatedSerial())
+
+    I/O worker
+    If the laser is used from multiple threads (e.g. by the asynchron modes of wait_for_finish and man_scan), a dedicated I/O worker thread can be
+    used, which is the only thread writing to and reading from the serial port. All other threads queue their commands and wait for the answers.
+    Queued commands are prioritised: stop commands are send first, then set commands and finally status queries.
+
+        # on initialisation
+        >>> qcl = QCL(worker=True)
+
+        # later on
+        >>> qcl.start_worker()
     """
 
     from collections import namedtuple
     _control = namedtuple("control", ["wn", "freq", "pw", "startwn", "stopwn", "rate", "cycles", "mode", "pause", "step", "interval"])
     _state = namedtuple("state", ["wn", "freq", "pw", "startwn", "stopwn", "rate", "cycles", "mode", "pause", "step", "whours", "scancount", "interval", "awn"])
     _query = namedtuple("query", ["wn", "freq", "pw", "startwn", "stopwn", "rate", "cycles", "mode", "pause", "step", "whours", "scancount", "awn", "all"])
-
-    def __init__(self, port=0, log=False, getall=True):
-        import serial
+    _timing = namedtuple("timing", ["steps", "duration", "jitter_mean", "jitter_max", "jitter_std", "jitter"])
+    _point = namedtuple("point", ["wn", "awn", "settle", "start", "end"])
+
+    # command registry: for each parameter the query command, parser of the answer, unit of the answer, set command, range, the resolution of
+    # the laser in decimals, the scanmodes in which the parameter is available (None: all scanmodes, None in the tuple: unknown scanmode) and
+    # the docstrings of the get and set function
+    _command = namedtuple("command", ["name", "query", "parse", "unit", "set", "range", "decimals", "modes", "get_doc", "set_doc"])
+    _Registry = (
+        _command("wn", ":laser:set?\n", _parse_float, "cm-1", ":laser:set {}\n", (980.04, 1244.99), 2, None,
+                 "get the current wavenumber.", "set wavenumber."),
+        _command("freq", ":pulse:freq?\n", _parse_float, "kHz", ":pulse:freq {}\n", (1.0, 100.0), 1, None,
+                 "get the current frequency.", "set frequency."),
+        _command("pw", ":pulse:width?\n", _parse_float, "usec", ":pulse:width {}\n", (0.04, 0.5), 3, None,
+                 "get the current pulsewidth.", "set pulsewidth."),
+        _command("startwn", ":scan:start?\n", _parse_float, "cm-1", ":scan:start {}\n", (980.04, 1244.99), 2, None,
+                 "get the current start wavenumber.", "set start wavenumber."),
+        _command("stopwn", ":scan:stop?\n", _parse_float, "cm-1", ":scan:stop {}\n", (980.04, 1244.99), 2, None,
+                 "get the current stop wavenumber.", "set stop wavenumber."),
+        _command("rate", ":scan:rate?\n", _parse_float, "", ":scan:rate {}\n", (1.0, 6.0), 0, None,
+                 "get the current scanrate.", "set scanrate."),
+        _command("cycles", ":scan:cycles?\n", _parse_float, "", ":scan:cycles {}\n", (1.0, 10000.0), 0, None,
+                 "get the number of scans.", "set number of scans."),
+        _command("mode", ":scan:mode?\n", _parse_int, "", ":scan:mode {}\n", (1.0, 4.0), 0, None,
+                 "get the current scanmode.",
+                 "set scanmode.\n\n        1 = automatic stepscan\n        2 = manual stepscan\n        3 = forward sweep\n        4 = forward_backward sweep\n        "),
+        _command("pause", ":scan:pause?\n", _parse_float, "sec", ":scan:pause {}\n", (0.0, 10.0), 1, (None, 1, 3, 4),
+                 "get the scan pause.", "set scan pause."),
+        _command("step", ":scan:step?\n", _parse_float, "cm-1", ":scan:step {}\n", (0.01, 264.95), 2, (1, 2),
+                 "get the step size for stepscan mode.", "set step size."),
+        _command("whours", ":info:hhrs?\n", _parse_float, "hrs", None, None, 1, None,
+                 "get the working hours.", None),
+        _command("scancount", ":scan:count?\n", _parse_int, "", None, None, 0, None,
+                 "get the number of scans during a measurment.", None),
+        _command("awn", ":laser:pos?\n", _parse_float, "cm-1", None, None, 2, None,
+                 "get the wavnumber the qcl contoller is currently outputting (not the one which is set).", None),
+    )
+
+    # tables derived from the registry
+    _Queries = _query(all=None, **dict((command.name, (command.query, command.parse)) for command in _Registry))
+    _Commands = _control(interval=None, **dict((command.name, command.set) for command in _Registry if command.set is not None))
+    _Range = _control(interval=(1.0, 1000.0), **dict((command.name, command.range) for command in _Registry if command.range is not None))
+    _Modes = dict((command.name, command.modes) for command in _Registry if command.modes is not None)
+    _Decimals = dict((command.name, command.decimals) for command in _Registry)
+
+    # default time to live in seconds of each parameter in the Stat tuple (see cached)
+    _TTL = _query(wn=60.0, freq=60.0, pw=60.0, startwn=60.0, stopwn=60.0, rate=60.0, cycles=60.0, mode=60.0, pause=60.0, step=60.0, whours=3600.0, scancount=0.5, awn=0.2, all=None)
+
+    # assumed sweep speed in cm-1/s per unit of the scanrate (see estimate_scan_time)
+    _scan_speed = 10.0
+
+    # priorities of the commands in the queue of the I/O worker
+    _STOP, _SET, _POLL = 0, 1, 2
+
+    def __init__(self, port=0, log=False, getall=True, worker=False, log_size=100000, transport=None, persist=False):
         super(QCL, self).__init__()
-        self.ser = serial.Serial(port)      # opens the COM1 port to communicate with the laser
-        self.ser.baudrate = 115200       # set the baudrate to 115200 to use the right speed to send data over
-        self.ser.timeout = 1             # set timeout for port to 1 second
+        self.state_file = _state_file(port) if persist is True else None
+        if transport is None:
+            import serial
+            self.ser = serial.Serial(port)      # opens the COM1 port to communicate with the laser
+            self.ser.baudrate = 115200       # set the baudrate to 115200 to use the right speed to send data over
+        else:
+            self.ser = transport             # any object with the write, read, in_waiting and close members of serial.Serial
+        if hasattr(self.ser, "timeout"):
+            self.ser.timeout = 0.01          # short read timeout, so the deadlines of the commands are kept within 10 ms (see timeout)
         self.log = log
-        self.log_file = []
-        self._Range = self._control(wn=(980.04, 1244.99), freq=(1.0, 100.0), pw=(0.04, 0.5), startwn=(980.04, 1244.99), stopwn=(980.04, 1244.99), rate=(1.0, 6.0), cycles=(1.0, 10000.0), mode=(1.0, 4.0), pause=(0.0, 10.0), step=(0.01, 264.95), interval=(1.0, 1000.0))
-        self.Set = self._control(wn=self.set_wn, freq=self.set_freq, pw=self.set_pw, startwn=self.set_startwn, stopwn=self.set_stopwn, rate=self.set_rate, cycles=self.set_cycles, mode=self.set_mode, pause=self.set_pause, step=self.set_step, interval=self.set_interval)
-        self.Get = self._query(wn=self.get_wn, freq=self.get_freq, pw=self.get_pw, startwn=self.get_startwn, stopwn=self.get_stopwn, rate=self.get_rate, cycles=self.get_cycles,
-                               mode=self.get_mode, pause=self.get_pause, step=self.get_step, whours=self.get_whours, scancount=self.get_scancount, awn=self.get_awn, all=self.get_all)
+        self.log_file = deque(maxlen=log_size)
+        self._log_sink = None            # background writer of the log entries (see log_to)
+        self.session = None              # SessionStore of the session (see store_to)
+        self._clock_offset = time() - monotonic()
+        self.metrics = Metrics()         # latency and error statistics of the communication with the laser
+        self.timeout = 1.0               # time in seconds to receive all answers of a command
+        self.timeouts = {}               # deviating timeouts of single commands by their metrics name (e.g. ":info:hhrs?" or "batch")
+        self.retries = 2                 # number of repetitions of failed queries
+        self.backoff = 0.01              # delay in seconds before the first repetition (doubled for each further one)
+        self._desync = False             # the answers are out of step with the commands (see _resync)
+        self._rx = b""                   # receive buffer for incomplete answers
+        self._queue = None               # command queue of the I/O worker (see start_worker)
+        self._worker = None
+        self.scan_timing = None          # timing statistics of the last man_scan
+        self.list_scan_points = None     # visited points of the last list_scan
+        self.timeline = None             # ScanTimeline (see qcl_telemetry), which indexes the wavenumber over time
+        self.tuning = TuningModel()      # learned settle time of the laser after a change of the wavenumber (see tune)
+        self.trusted = False             # skip the verification of set commands (see verify)
+        self._unverified = set()         # parameters set in trusted mode, which have not been verified yet
+        self._updated = {}               # time (monotonic) of the last update of each parameter in the Stat tuple
+        self.TTL = self._TTL
+        self.Set = self._control(interval=self.set_interval, **dict((command.name, getattr(self, "set_" + command.name)) for command in self._Registry if command.set is not None))
+        self.Get = self._query(all=self.get_all, **dict((command.name, getattr(self, "get_" + command.name)) for command in self._Registry))
         self.Stat = self._state(wn=None, freq=None, pw=None, startwn=None, stopwn=None, rate=None, cycles=None, mode=None, pause=None, step=None, whours=None, scancount=None, interval=3, awn=None)
+        if worker is True:
+            self.start_worker()
+        if getall == "lazy":
+            self.Stat = _LazyState._make(self.Stat)
+            self.Stat._qcl = self
+        restored = self.state_file is not None and self.load_state()
         if getall is True:
-            self.get_all()
+            if restored:
+                self.refresh()
+            else:
+                self.get_all()
 
     def _log_write(self, string, mode):
-        from datetime import datetime
-        string = str(string)
-        date = str(datetime.now()).split('.')[0]
-        if self.log is True:
-            if mode == "read":
-                msg = "<<< " + string
-            elif mode == "write":
-                msg = ">>> " + string
-            self.log_file.append((msg, date))
-        else:
-            pass
+        if self.log is not True:
+            return
+        entry = (("<<< " if mode == "read" else ">>> ") + string, monotonic())
+        self.log_file.append(entry)
+        if self._log_sink is not None:
+            self._log_sink.put(entry)
+        if self.session is not None:
+            self.session.add_event(entry[1], "r" if mode == "read" else "w", string)
 
     def save_log(self, file):
+        """append all log entries of the log_file ring to a text file and clear it."""
+        from datetime import datetime
         with open(file, "a") as f:
-            for line in self.log_file:
-                f.write("[{}] {}".format(line[0], line[1]))
-        self.log_file = []
-
-    def get_wn(self):
-        """get the current wavenumber."""
-        command = ":laser:set?\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        answer = self.ser.read(13)
-        self._log_write(answer, mode="read")
-        rlvalue = float(answer[:-6])
-        self.Stat = self.Stat._replace(wn=rlvalue)
-        return rlvalue
+            for msg, timestamp in list(self.log_file):
+                date = str(datetime.fromtimestamp(timestamp + self._clock_offset)).split('.')[0]
+                f.write("[{}] {}\n".format(date, msg.rstrip()))
+        self.log_file.clear()
 
-    def set_wn(self, value):
-        """set wavenumber."""
-        if float(value) < self._Range.wn[0] or float(value) > self._Range.wn[1]:
-            raise ValueError("{} is out of range!".format(str(value)))
-        command = ":laser:set {}\n".format(str(value))
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        rlvalue = self.get_wn()
-        return rlvalue
-
-    def get_freq(self):
-        """get the current frequency."""
-        command = ":pulse:freq?\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        answer = self.ser.read(10)
-        self._log_write(answer, mode="read")
-        rlvalue = float(answer[:-5])
-        self.Stat = self.Stat._replace(freq=rlvalue)
-        return rlvalue
+    def log_to(self, file, max_bytes=10 * 2 ** 20, backups=5):
+        """stream all log entries to a rotating JSON lines file and enable logging.
 
-    def set_freq(self, value):
-        """set frequency."""
-        if float(value) < self._Range.freq[0] or float(value) > self._Range.freq[1]:
-            raise ValueError("{} is out of range!".format(str(value)))
-        command = ":pulse:freq {}\n".format(value)
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        rlvalue = self.get_freq()
-        return rlvalue
+        The entries are written by a background thread, so the communication with the laser is not slowed down by file access. Each line contains
+        the wall clock time, the monotonic timestamp and the message of one entry. If the file is larger than max_bytes, it is renamed to file.1
+        (older files to file.2 and so on, keeping the given number of backups) and a new file is started.
+        """
+        self.close_log()
+        self._log_sink = _LogWriter(file, self._clock_offset, max_bytes, backups)
+        self.log = True
 
-    def get_pw(self):
-        """get the current pulsewidth."""
-        command = ":pulse:width?\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        answer = self.ser.read(10)
-        self._log_write(answer, mode="read")
-        rlvalue = float(answer[:-6])
-        self.Stat = self.Stat._replace(pw=rlvalue)
-        return rlvalue
+    def record(self, file):
+        """record an exact transcript of all data send to and received from the laser with timestamps (see qcl_replay.py).
 
-    def set_pw(self, value):
-        """set pulsewidth."""
-        if float(value) < self._Range.pw[0] or float(value) > self._Range.pw[1]:
-            raise ValueError("{} is out of range!".format(str(value)))
-        command = ":pulse:width {}\n".format(value)
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        rlvalue = self.get_pw()
-        return rlvalue
+        Transcripts can be replayed later on with the ReplayTransport class of the qcl_replay module.
+        """
+        from qcl_replay import RecordingTransport
+        self.ser = RecordingTransport(self.ser, file)
 
-    def get_startwn(self):
-        """get the current start wavenumber."""
-        command = ":scan:start?\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        answer = self.ser.read(13)
-        self._log_write(answer, mode="read")
-        rlvalue = float(answer[:-6])
-        self.Stat = self.Stat._replace(startwn=rlvalue)
-        return rlvalue
+    def store_to(self, directory, flush_interval=1.0):
+        """append all log entries and every update of the Stat tuple to a session store and enable logging (see qcl_session.py).
 
-    def set_startwn(self, value):
-        """set start wavenumber."""
-        if float(value) < self._Range.startwn[0] or float(value) > self._Range.startwn[1]:
-            raise ValueError("{} is out of range!".format(str(value)))
-        command = ":scan:start {}\n".format(value)
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        rlvalue = self.get_startwn()
-        return rlvalue
+        The store is flushed every flush_interval seconds and can be read with qcl_session.load_session, also by another process while the
+        session is still running. An existing store in the directory is continued.
+        """
+        from qcl_session import SessionStore
+        self.close_store()
+        self.session = SessionStore(directory, flush_interval=flush_interval)
+        self.session.add_state(monotonic(), self.Stat)
+        self.log = True
+
+    def close_store(self):
+        """flush and close the session store (see store_to)."""
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def stop_recording(self):
+        """stop recording the transcript (see record)."""
+        if hasattr(self.ser, "stop"):
+            self.ser = self.ser.stop()
+
+    def close_log(self):
+        """stop streaming log entries to a file (see log_to)."""
+        if self._log_sink is not None:
+            self._log_sink.close()
+            self._log_sink = None
+
+    def _write(self, command):
+        """send a command string to the laser."""
+        if self.log is True:
+            self._log_write(command, mode="write")
+        self.ser.write(command.encode("ascii"))
 
-    def get_stopwn(self):
-        """get the current stop wavenumber."""
-        command = ":scan:stop?\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        answer = self.ser.read(13)
-        self._log_write(answer, mode="read")
-        rlvalue = float(answer[:-6])
-        self.Stat = self.Stat._replace(stopwn=rlvalue)
-        return rlvalue
+    def _read_answer(self, deadline=None):
+        """read the next answer of the laser.
 
-    def set_stopwn(self, value):
-        """set stop wavenumber."""
-        if float(value) < self._Range.stopwn[0] or float(value) > self._Range.stopwn[1]:
-            raise ValueError("{} is out of range!".format(str(value)))
-        command = ":scan:stop {}\n".format(value)
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        rlvalue = self.get_stopwn()
-        return rlvalue
+        Incoming data is collected in a receive buffer until a complete line is available. Therefore the function returns as soon
+        as the answer has arrived, independent of its length. Only if the laser does not answer until the deadline (or within the
+        port timeout without deadline), the incomplete remainder of the buffer is returned.
+        """
+        while b"\n" not in self._rx:
+            data = self.ser.read(self.ser.in_waiting or 1)
+            if data:
+                self._rx += data
+            elif deadline is None or monotonic() >= deadline:
+                break
+        answer, end, self._rx = self._rx.partition(b"\n")
+        answer = (answer + end).decode("ascii", "replace")
+        if self.log is True:
+            self._log_write(answer, mode="read")
+        return answer
 
-    def get_rate(self):
-        """get the current scanrate."""
-        command = ":scan:rate?\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        answer = self.ser.read(3)
-        self._log_write(answer, mode="read")
-        rlvalue = float(answer[:-2])
-        self.Stat = self.Stat._replace(rate=rlvalue)
-        return rlvalue
+    def _exchange(self, command, answers):
+        """send a command and read the given number of answers.
 
-    def set_rate(self, value):
-        """set scanrate."""
-        if float(value) < self._Range.rate[0] or float(value) > self._Range.rate[1]:
-            raise ValueError("{} is out of range!".format(str(value)))
-        command = ":scan:rate {}\n".format(value)
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        rlvalue = self.get_rate()
-        return rlvalue
+        If the answers of a previous command were incomplete or malformed, the receive buffer is resynchronised first. If not all answers
+        arrive before the deadline of the command (see timeout and timeouts), a QCLTimeoutError is raised.
+        """
+        if self._desync is True:
+            self._resync()
+        key = _command_key(command)
+        timeout = self.timeouts.get(key, self.timeout)
+        start = perf_counter()
+        deadline = monotonic() + timeout
+        self._write(command)
+        received = [self._read_answer(deadline) for _ in range(answers)]
+        missing = bool(received) and not received[-1].endswith("\n")
+        self.metrics.record(key, perf_counter() - start, len(command), sum(len(answer) for answer in received), missing)
+        if missing:
+            self._desync = True
+            raise QCLTimeoutError("no answer to {!r} within {} s".format(command, timeout))
+        return received
+
+    def _resync(self, quiet=0.01, limit=0.2):
+        """discard all received data, so the next answer belongs to the next command.
+
+        After a timeout or a malformed answer, late or remaining answers of the failed command would be read as answers of the following
+        commands. Therefore the receive buffer and the input buffer of the port are cleared, as soon as no data was received for quiet
+        seconds (at most after limit seconds).
+        """
+        from time import sleep
+        start = perf_counter()
+        self._desync = False
+        self._rx = b""
+        end = monotonic() + limit
+        sleep(quiet)
+        while self.ser.in_waiting and monotonic() < end:
+            self.ser.read(self.ser.in_waiting)
+            sleep(quiet)
+        if hasattr(self.ser, "reset_input_buffer"):
+            self.ser.reset_input_buffer()
+        self.metrics.record("resync", perf_counter() - start)
+
+    def _transact(self, command, answers=0, priority=_POLL):
+        """send a command and return the list of its answers.
+
+        Without an I/O worker the command is executed directly in the calling thread. Otherwise it is put into the priority queue
+        of the worker and the calling thread waits for the result.
+        """
+        if self._queue is None:
+            return self._exchange(command, answers)
+        return self._submit(command, answers, priority).result()
 
-    def get_cycles(self):
-        """get the number of scans."""
-        command = ":scan:cycles?\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        answer = self.ser.read(20)
-        self._log_write(answer, mode="read")
-        rlvalue = float(answer[:-2])
-        self.Stat = self.Stat._replace(cycles=rlvalue)
-        return rlvalue
+    def _submit(self, command, answers=0, priority=_POLL):
+        """queue a command for the I/O worker and return a future for the list of its answers.
 
-    def set_cycles(self, value):
-        """set number of scans."""
-        if float(value) < self._Range.cycles[0] or float(value) > self._Range.cycles[1]:
-            raise ValueError("{} is out of range!".format(str(value)))
-        command = ":scan:cycles {}\n".format(value)
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        rlvalue = self.get_cycles()
+        Commands with a lower priority value are executed first (_STOP before _SET before _POLL). Commands with the same priority
+        are executed in the order they were submitted.
+        """
+        from concurrent.futures import Future
+        if self._queue is None:
+            raise RuntimeError("the I/O worker is not running")
+        future = Future()
+        self._queue.put((priority, next(self._order), command, answers, future))
+        return future
+
+    def _run_worker(self):
+        """main loop of the I/O worker thread, which is the only thread accessing the serial port."""
+        while True:
+            priority, order, command, answers, future = self._queue.get()
+            if future is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._exchange(command, answers))
+            except Exception as error:
+                future.set_exception(error)
+
+    def start_worker(self):
+        """start the I/O worker thread.
+
+        While the worker is running, all communication with the laser is done by a single thread, which executes the queued commands
+        by their priority (stop commands first, then set commands, then status queries). This prevents interleaved commands and
+        answers, if multiple threads (e.g. the timers of wait_for_finish or man_scan) use the laser at the same time.
+        """
+        from itertools import count
+        from queue import PriorityQueue
+        from threading import Thread
+        if self._queue is not None:
+            return
+        self._order = count()
+        self._queue = PriorityQueue()
+        self._worker = Thread(target=self._run_worker, name="qcl-io-worker")
+        self._worker.daemon = True
+        self._worker.start()
+
+    def stop_worker(self):
+        """stop the I/O worker thread after all queued commands are executed."""
+        if self._queue is None:
+            return
+        self._queue.put((self._POLL + 1, next(self._order), None, 0, None))
+        self._worker.join()
+        self._queue = None
+        self._worker = None
+
+    def _store(self, values):
+        """write values received from the laser to the Stat tuple and remember the time of the update."""
+        self.Stat = self.Stat._replace(**values)
+        now = monotonic()
+        for name in values:
+            self._updated[name] = now
+        if self.timeline is not None and values.get("awn") is not None:
+            self.timeline.add_awn(now, values["awn"])
+        if self.session is not None:
+            self.session.add_state(now, self.Stat)
+
+    def _set(self, name, command, value):
+        """send a set command and verify the new value (or write it to the Stat tuple directly in trusted mode)."""
+        start = perf_counter()
+        self._transact(command, priority=self._SET)
+        if self.trusted is True:
+            rlvalue = int(value) if getattr(self._Queries, name)[1] is _parse_int else float(value)
+            self._store({name: rlvalue})
+            self._unverified.add(name)
+            return rlvalue
+        rlvalue = self._get(name)
+        self.metrics.record(_command_key(command) + "+verify", perf_counter() - start)
         return rlvalue
 
-    def get_mode(self):
-        """get the current scanmode."""
-        command = ":scan:mode?\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        answer = self.ser.read(3)
-        self._log_write(answer, mode="read")
-        rlvalue = int(answer[:-2])
-        self.Stat = self.Stat._replace(mode=rlvalue)
-        return rlvalue
+    def recipe(self, **values):
+        """create a validated scan recipe.
 
-    def set_mode(self, value):
-        """set scanmode.
+        A recipe contains the values of all given parameters (see Set) and None for all other parameters. All values are rounded to
+        the resolution of the laser (see the decimals of the _Registry) and checked against the _Range tuple on creation, so a recipe
+        can be applied multiple times without further checks. Unknown parameters and None values raise a ValueError.
 
-        1 = automatic stepscan
-        2 = manual stepscan
-        3 = forward sweep
-        4 = forward_backward sweep
+            >>> survey = qcl.recipe(startwn=990, stopwn=1240, rate=3, mode=3, cycles=5)
+            >>> qcl.apply_recipe(survey)
         """
-        if float(value) < self._Range.mode[0] or float(value) > self._Range.mode[1]:
-            raise ValueError("{} is out of range!".format(str(value)))
-        command = ":scan:mode {}\n".format(str(int(value)))
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        rlvalue = self.get_mode()
-        return rlvalue
+        for name, value in values.items():
+            if name not in self._control._fields:
+                raise ValueError("{!r} is no settable parameter!".format(name))
+            if value is None:
+                raise ValueError("no value given for {!r}!".format(name))
+            if self._Decimals.get(name) is not None:
+                values[name] = round(float(value), self._Decimals[name])
+        recipe = self._control(**dict((name, values.get(name)) for name in self._control._fields))
+        for name, value in values.items():
+            if float(value) < getattr(self._Range, name)[0] or float(value) > getattr(self._Range, name)[1]:
+                raise ValueError("{} is out of range!".format(str(value)))
+        return recipe
 
-    def get_pause(self):
-        """get the scan pause."""
-        if self.Stat.mode == 2:
-            pass
-        else:
-            command = ":scan:pause?\n"
-            self._log_write(command, mode="write")
-            self.ser.write(command)
-            answer = self.ser.read(9)
-            self._log_write(answer, mode="read")
-            rlvalue = float(answer[:-5])
-            self.Stat = self.Stat._replace(pause=rlvalue)
-            return rlvalue
+    def apply_recipe(self, recipe, verify=True):
+        """apply a scan recipe to the laser.
 
-    def set_pause(self, value):
-        """set scan pause."""
-        if self.Stat.mode == 2:
-            pass
-        else:
-            if float(value) < self._Range.pause[0] or float(value) > self._Range.pause[1]:
-                raise ValueError("{} is out of range!".format(str(value)))
-            command = ":scan:pause {}\n".format(str(value))
-            self._log_write(command, mode="write")
-            self.ser.write(command)
-            rlvalue = self.get_pause()
-            return rlvalue
+        Only the parameters, which differ from the values in the Stat tuple, are send to the laser. All of them are send in a single write.
+        Pause and step are skipped, if they are not available in the scanmode of the recipe (or the current scanmode, if the recipe does not
+        contain a scanmode). If verify is True, the new values are queried with a single get_batch call afterwards and a ValueError is raised,
+        if the laser did not accept one of them. Otherwise the values are handled like values set in trusted mode (see verify).
+        A dictionary of all send values is returned.
+        """
+        mode = self.Stat.mode if recipe.mode is None else int(recipe.mode)
+        changes = {}
+        for name, value in zip(recipe._fields, recipe):
+            if value is None:
+                continue
+            if (name == "pause" and mode == 2) or (name == "step" and not (mode == 1 or mode == 2)):
+                continue
+            value = int(value) if name == "mode" else float(value)
+            if _same(self.Stat[self._state._fields.index(name)], value, self._Decimals.get(name)):   # index access does not query unknown values in lazy mode
+                continue
+            changes[name] = value
+        if "interval" in changes:
+            self.set_interval(changes["interval"])
+        commands = [getattr(self._Commands, name).format(value) for name, value in changes.items() if name != "interval"]
+        if commands:
+            self._transact("".join(commands), priority=self._SET)
+            self._store(dict((name, value) for name, value in changes.items() if name != "interval"))
+            self._unverified.update(name for name in changes if name != "interval")
+        if verify is True:
+            mismatches = self.verify()
+            if mismatches:
+                raise ValueError("the laser did not accept {}".format(mismatches))
+        return changes
+
+    def verify(self):
+        """verify all values set in trusted mode.
+
+        The unverified parameters are queried with a single get_batch call. A dictionary of all parameters, for which the laser reports a
+        different value (at the resolution of the laser) than the one which was set, is returned with the pairs of set and real value. The Stat tuple contains the real values afterwards.
+
+            >>> qcl.trusted = True
+            >>> qcl.set_startwn(1000)
+            >>> qcl.set_stopwn(1200)
+            >>> qcl.verify()
+            {}
+        """
+        expected = dict((name, getattr(self.Stat, name)) for name in self._unverified)
+        self._unverified = set()
+        values = self.get_batch(list(expected))
+        return dict((name, (expected[name], value)) for name, value in values.items() if not _same(value, expected[name], self._Decimals[name]))
 
-    def get_step(self):
-        """get the step size for stepscan mode."""
-        if not (self.Stat.mode == 1 or self.Stat.mode == 2):
-            pass
-        else:
-            command = ":scan:step?\n"
-            self._log_write(command, mode="write")
-            self.ser.write(command)
-            answer = self.ser.read(11)
-            self._log_write(answer, mode="read")
-            rlvalue = float(answer[:-6])
-            self.Stat = self.Stat._replace(step=rlvalue)
-            return rlvalue
+    def cached(self, name, max_age=None):
+        """get a parameter from the Stat tuple, if it is not older than its time to live, and query it from the laser otherwise.
 
-    def set_step(self, value):
-        """set step size."""
-        if not (self.Stat.mode == 1 or self.Stat.mode == 2):
-            pass
-        else:
-            if float(value) < self._Range.step[0] or float(value) > self._Range.step[1]:
-                raise ValueError("{} is out of range!".format(str(value)))
-            command = ":scan:step {}\n".format(str(value))
-            self._log_write(command, mode="write")
-            self.ser.write(command)
-            rlvalue = self.get_step()
-            return rlvalue
+        The default time to live of each parameter is defined in the TTL tuple (in seconds). A different maximal age can be passed with the max_age parameter.
+        """
+        if name not in self._query._fields[:-1]:
+            return getattr(self.Stat, name)
+        if name in self._fresh([name], max_age):
+            return getattr(self.Stat, name)
+        return getattr(self.Get, name)()
+
+    def refresh(self, names=None, max_age=None):
+        """query all given parameters (default: all parameters), which are older than their time to live, with a single get_batch call."""
+        if names is None:
+            names = self._query._fields[:-1]
+        fresh = self._fresh(names, max_age)
+        stale = [name for name in names if name not in fresh]
+        self.get_batch([name for name in stale if name not in ("pause", "step")])
+        self.get_batch([name for name in stale if name in ("pause", "step")])
+        return self.Stat
+
+    def _fresh(self, names, max_age=None):
+        """return the subset of the given parameters, whose value in the Stat tuple is younger than their time to live."""
+        now = monotonic()
+        fresh = set()
+        for name in names:
+            age = now - self._updated.get(name, float("-inf"))
+            if age <= (getattr(self.TTL, name) if max_age is None else max_age):
+                fresh.add(name)
+        return fresh
+
+    def _parse(self, name, answer):
+        """convert an answer with the parser from the _Queries table and count failures in the metrics.
+
+        The answer must consist of a single value, an optional unit and the line end. Otherwise (e.g. if a byte got lost and two answers
+        were merged) a QCLParseError is raised and the receive buffer is resynchronised before the next command. The unit itself is not
+        compared with the unit of the _Registry, so deviating spellings of the controller are accepted.
+        """
+        command, parse = getattr(self._Queries, name)
+        if _frame.match(answer) is None:
+            self.metrics.parse_failure(_command_key(command))
+            self._desync = True
+            raise QCLParseError("unexpected answer {!r} to {!r}".format(answer, command))
+        return parse(answer)
+
+    def _request(self, names):
+        """send the queries of the given parameters in a single write and return the parsed answers.
+
+        Queries do not change the laser state, so they are repeated up to retries times after a timeout or a malformed answer. The delay
+        before each repetition starts with backoff seconds and is doubled every time.
+        """
+        from time import sleep
+        command = "".join(getattr(self._Queries, name)[0] for name in names)
+        attempt = 0
+        while True:
+            try:
+                answers = self._transact(command, answers=len(names))
+                return [self._parse(name, answer) for name, answer in zip(names, answers)]
+            except QCLError:
+                if attempt >= self.retries:
+                    raise
+                self.metrics.retry(_command_key(command))
+                sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+
+    def _get(self, name):
+        """query a single parameter using the _Queries table and store its value in the Stat tuple."""
+        rlvalue, = self._request([name])
+        self._store({name: rlvalue})
+        return rlvalue
 
     def set_interval(self, value):
         """set the interval time for a manual step scan.
@@ -394,139 +894,508 @@ class QCL(object):
         self.Stat = self.Stat._replace(interval=float(value))
         return value
 
-    def get_whours(self):
-        """get the working hours."""
-        command = ":info:hhrs?\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        answer = self.ser.read(11)
-        self._log_write(answer, mode="read")
-        rlvalue = float(answer[:-5])
-        self.Stat = self.Stat._replace(whours=rlvalue)
-        return rlvalue
-
-    def get_scancount(self):
-        """get the number of scans during a measurment."""
-        command = ":scan:count?\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        answer = self.ser.read(6)
-        self._log_write(answer, mode="read")
-        rlvalue = int(answer[:-2])
-        self.Stat = self.Stat._replace(scancount=rlvalue)
-        return rlvalue
+    def save_state(self, file=None):
+        """save the known laser state to a JSON file (default: the state_file of the port).
 
-    def get_awn(self):
-        """get the wavnumber the qcl contoller is currently outputting (not the one which is set)."""
-        command = ":laser:pos?\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
-        answer = self.ser.read(13)
-        self._log_write(answer, mode="read")
-        rlvalue = float(answer[:-6])
-        self.Stat = self.Stat._replace(awn=rlvalue)
-        return rlvalue
+        The volatile parameters awn and scancount are not saved.
+        """
+        file = file or self.state_file
+        directory = os.path.dirname(file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        state = dict((name, value) for name, value in zip(self.Stat._fields, tuple(self.Stat)) if name not in ("awn", "scancount"))
+        with open(file + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(file + ".tmp", file)
+
+    def load_state(self, file=None):
+        """restore the laser state saved by save_state, if it is still valid.
+
+        To check, if the laser state was changed in the meantime, the working hours and the wavenumber are queried from the laser with a single
+        get_batch call and compared with the saved values. If both are equal, all saved values are written to the Stat tuple and True is returned.
+        """
+        file = file or self.state_file
+        try:
+            with open(file) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        probe = self.get_batch(["whours", "wn"])
+        if not all(_same(probe[name], state.get(name), self._Decimals[name]) for name in probe):
+            return False
+        self._store(dict((name, value) for name, value in state.items() if name in self._state._fields and name not in probe and value is not None))
+        return True
+
+    def _query_allowed(self, name):
+        """check if a parameter can be queried in the current scanmode (see the modes of the _Registry)."""
+        modes = self._Modes.get(name)
+        return modes is None or self.Stat.mode in modes
+
+    def get_batch(self, names):
+        """get multiple parameters with a single write.
+
+        All query commands are send to the laser in one buffered write and the answers are read back in the same order. Parameters,
+        which can not be queried in the current scanmode (pause and step, see get_pause and get_step), are skipped. The Stat tuple is
+        updated with all received values and a dictionary of these values is returned.
+
+            >>> qcl.get_batch(["awn", "scancount"])
+            {'awn': 1080.0, 'scancount': 3}
+        """
+        names = [name for name in names if self._query_allowed(name)]
+        if not names:
+            return {}
+        values = dict(zip(names, self._request(names)))
+        self._store(values)
+        return values
 
     def get_all(self):
-        """get the full current laser state."""
-        for command in self.Get[:-1]:
-            command()
+        """get the full current laser state.
+
+        All parameters are queried using get_batch. Since the availability of pause and step depends on the scanmode, these two
+        parameters are queried in a second batch after the new scanmode is known. This reduces a full refresh to two round trips.
+        """
+        names = [name for name in self._query._fields[:-1] if name not in ("pause", "step")]
+        self.get_batch(names)
+        self.get_batch(["pause", "step"])
         return self.Stat
 
     def scan_start(self):
         """send start command."""
         command = ":scan:run 1\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
+        self._transact(command, priority=self._SET)
+        if self.timeline is not None:
+            self.timeline.add_step(monotonic())
 
     def scan_stop(self):
         """send stop command."""
         command = ":scan:run 0\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
+        self._transact(command, priority=self._STOP)
+        if self.timeline is not None:
+            self.timeline.add_end(monotonic())
 
     def step_next(self):
         """jump to the next wavenumber in manual stepscan."""
         command = ":scan:step:next\n"
-        self._log_write(command, mode="write")
-        self.ser.write(command)
+        self._transact(command, priority=self._SET)
+        if self.timeline is not None:
+            self.timeline.add_step(monotonic())
 
     def close(self):
-        """close the port."""
-        self.ser.close()
+        """close the port (and save the laser state, if persist was set on initialisation).
 
-    def wait_for_finish(self, interval=3.0, asynchron=False):
+        The worker, the log and the store are stopped and the port is closed, even if saving the laser state fails.
+        """
+        try:
+            if self.state_file is not None:
+                self.save_state()
+        finally:
+            try:
+                self.stop_worker()
+                self.close_log()
+                self.close_store()
+            finally:
+                self.ser.close()
+
+    def estimate_scan_time(self):
+        """estimate the duration in seconds of a complete scan with the parameters of the Stat tuple.
+
+        The sweep speed is assumed to be the scanrate multiplied with the _scan_speed attribute (in cm-1/s). Stepscans additionally include the
+        pause at each wavenumber (automatic stepscan) or the interval of man_scan (manual stepscan). The estimate is only used as a starting
+        point by the ScanMonitor, which corrects it with the observed progress of the scan.
+        """
+        span = abs(self.Stat.stopwn - self.Stat.startwn)
+        sweep = span / (self.Stat.rate * self._scan_speed)
+        if self.Stat.mode == 1 or self.Stat.mode == 2:
+            points = int(span / self.Stat.step + 1e-9) + 1
+            if self.Stat.mode == 2:
+                return points * self.Stat.interval * self.Stat.cycles
+            return (points * (self.Stat.pause or 0.0) + sweep) * self.Stat.cycles
+        if self.Stat.mode == 4:
+            return 2 * sweep * self.Stat.cycles
+        return sweep * self.Stat.cycles
+
+    def wait_for_finish(self, interval=3.0, asynchron=False, callback=None):
         """Give information, when current scans are finished.
 
-        The function queries the current scancount every few seconds (defined by the interval parameter). By calling the get_scancount function, the Stat value of this paramater is also refreshed.
-        Based on the value of the asynchron parameter of this function, different type of timers are used. If asynchron is false, a synchrone sleeptimer is used.
-        Therefore the script will be blocked until the current scans are finished (indicated by a scancount of 0).
-        If a asynchron parameter is specified, a asynchron timer in a different thread is used. Therefore the application is not blocked.
-        Latter must only be used for multithreading applications, such like GUIs, while the synchrone timer is a way to delay the execution of a simple script, until scans have finished
+        The function queries the current scancount (and the real wavenumber) using a ScanMonitor. By calling the get_batch function, the Stat values of these paramaters are also refreshed.
+        The time between the queries is adapted to the remaining scan time: Early in the scan the laser is only queried every interval seconds, close to the predicted end of the scan
+        much more often. Therefore the function returns shortly after the scan has finished.
+        Based on the value of the asynchron parameter of this function, different type of timers are used. If asynchron is false, the script will be blocked until the current scans are finished
+        (indicated by a scancount of 0). If a asynchron parameter is specified, the monitor runs in a different thread (and the I/O worker is started). Therefore the application is not blocked.
+        Latter must only be used for multithreading applications, such like GUIs, while the synchrone timer is a way to delay the execution of a simple script, until scans have finished.
+        In both cases the ScanMonitor is returned. Its future, event and callbacks can be used to get notified, when the scans are finished. The callback parameter is a shortcut to add
+        a function, which is called with the final Stat tuple.
 
             # simple script example
             >>> qcl.scan_start() # starting scans
             >>> qcl.wait_for_finish() # blocking the session/script until the scans are finished
             >>> # do stuff after scans
 
-        WARINING: It is advised not to choose an interval value shorter than 2 seconds!!!!
+            # asynchronous example
+            >>> qcl.scan_start()
+            >>> monitor = qcl.wait_for_finish(asynchron=True, callback=lambda stat: print("finished"))
+            >>> monitor.future.result() # or monitor.event.wait()
         """
-        def asynchron_timer(interval=interval):
-            self.get_scancount()
-            if self.Stat.scancount != 0:
-                timer = Timer(interval, asynchron_timer)
-                timer.start()
-            else:
-                pass
-
+        monitor = ScanMonitor(self, max_interval=interval)
+        if callback is not None:
+            monitor.add_callback(callback)
         if asynchron is False:
-            from time import sleep
-            sleep(3)  # prevent issues, when the function is called directly after the scan-start function
-            while True:
-                self.get_scancount()
-                if self.Stat.scancount == 0:
-                    break
-                sleep(interval)
-
+            monitor.run()
         else:
-            from threading import Timer
-            timer = Timer(3.0, asynchron_timer)  # prevent issues, when the function is called directly after the scan-start function
-            timer.start()
+            monitor.start()
+        return monitor
+
+    def _man_scan_steps(self, interval):
+        """step loop of man_scan, which calls the next command at fixed deadlines and collects the timing of each step."""
+        from math import sqrt
+        from time import monotonic, sleep
+        start = monotonic()
+        jitter = []
+        step = 1
+        while True:
+            deadline = start + step * interval
+            delay = deadline - monotonic()
+            if delay > 0:
+                sleep(delay)
+            self.get_batch(["scancount", "awn"])
+            if self.Stat.scancount == 0:
+                if self.timeline is not None:
+                    self.timeline.add_end(self._updated["scancount"])
+                break
+            self._transact(":scan:step:next\n", priority=self._SET)
+            stepped = monotonic()
+            jitter.append(stepped - deadline)
+            if self.get_scancount() == 0:     # the next command after the last wavenumber ends the scan
+                if self.timeline is not None:
+                    self.timeline.add_end(stepped)
+                break
+            if self.timeline is not None:
+                self.timeline.add_step(stepped)
+            step += 1
+        mean = sum(jitter) / len(jitter) if jitter else 0.0
+        std = sqrt(sum((value - mean) ** 2 for value in jitter) / len(jitter)) if jitter else 0.0
+        self.scan_timing = self._timing(steps=len(jitter), duration=monotonic() - start, jitter_mean=mean, jitter_max=max(jitter or [0.0]), jitter_std=std, jitter=tuple(jitter))
+        return self.scan_timing
 
     def man_scan(self, asynchron=True):
         """Run a semi-automatic stepscan.
 
         The function is used to run a stepscan in a defined time interval. Therfor the manual stepscan mode of the laser is used
         and the function calls the next command every few seconds (defined by the interval Stat). Similar to the wait_for_finish
-        function a synchronous and a asynchronous mode are available.
-        Before the function can be used, the laser must have been set to manual scanmode (mode 2) already. Please note, that due
-        to a delay in the command processing on the laser side, the actual scan takes a view seconds longer. (For example: scan from 990-1240,
-        stepsize: 25 and interval: 5s takes about 62 s instead of 55 seconds).
+        function a synchronous and a asynchronous mode are available. In the asynchronous mode the steps are executed by a single
+        background thread and the I/O worker is started, so the laser can still be used from other threads.
+        Before the function can be used, the laser must have been set to manual scanmode (mode 2) already.
+
+        The next commands are send at fixed deadlines (start + n * interval) measured with a monotonic clock. The time needed to query
+        the scan status is therefore subtracted from the waiting time and does not add up over the scan. The scancount is queried directly
+        after each next command, so the function returns as soon as the next command after the last wavenumber has ended the scan.
+        (For example: scan from 990-1240, stepsize: 25 and interval: 5s takes 55 seconds.) After the scan the timing statistics are available in the scan_timing tuple
+        (and returned in the synchronous mode). The jitter values are the delays of each next command relative to its deadline in seconds.
+
+            >>> qcl.man_scan(asynchron=False)
+            timing(steps=11, duration=55.0, jitter_mean=0.002, jitter_max=0.004, jitter_std=0.001, jitter=(...))
         """
         interval = self.Stat.interval
         self.scan_start()
 
-        def asynchron_timer(interval=interval):
-            self.get_scancount()
-            self.get_awn()
-            if self.Stat.scancount != 0:
-                self.step_next()
-                timer = Timer(interval, asynchron_timer)
-                timer.start()
-            else:
-                pass
+        if asynchron is False:
+            return self._man_scan_steps(interval)
+
+        else:
+            from threading import Thread
+            self.start_worker()          # the step thread and the calling thread must not use the port at the same time
+            thread = Thread(target=self._man_scan_steps, args=(interval,), name="qcl-man-scan")
+            thread.daemon = True
+            thread.start()
+
+    def tune(self, wn, tolerance=0.1, timeout=10.0, poll=0.01):
+        """set the wavenumber and wait, until the real wavenumber is within tolerance of the new wavenumber.
+
+        Instead of the verification of set_wn, the real wavenumber is queried. The first query is send poll seconds after the new wavenumber,
+        then the interval doubles, but stays below 1/8 of the settle time predicted by the tuning model. So a change of the wavenumber needs
+        only a few queries, while a settle time shorter than the prediction is still measured. The settle time (middle between the last query
+        outside and the first query within tolerance) is returned (None, if the laser did not settle within timeout seconds). It is added to
+        the tuning model, unless the laser was already settled at the first query (then it is only an upper bound).
+        """
+        if float(wn) < self._Range.wn[0] or float(wn) > self._Range.wn[1]:
+            raise ValueError("{} is out of range!".format(str(wn)))
+        from time import sleep
+        distance = abs(float(wn) - self.cached("awn"))     # the real wavenumber is queried again, if it is older than its TTL
+        start = monotonic()
+        self._transact(self._Commands.wn.format(wn), priority=self._SET)
+        self._store({"wn": float(wn)})
+        limit = max(self.tuning.predict(distance) / 8.0, poll)
+        interval = poll
+        last = None                      # time of the last query outside of tolerance
+        while True:
+            sleep(interval)
+            awn = self.get_awn()
+            answered = monotonic() - start
+            if abs(awn - float(wn)) <= tolerance:
+                break
+            if answered >= timeout:
+                return None
+            last = answered
+            interval = min(2.0 * interval, limit)
+        if last is None:
+            return answered
+        settle = (last + answered) / 2.0
+        self.tuning.observe(distance, settle)
+        return settle
+
+    @staticmethod
+    def _visit_order(wavenumbers, position):
+        """sort the wavenumbers, starting at the end nearer to the current position, which minimizes the tuning distance."""
+        order = sorted(wavenumbers)
+        if order and abs(order[-1] - position) < abs(order[0] - position):
+            order.reverse()
+        return order
+
+    def _list_scan_points(self, wavenumbers, dwell, tolerance, callback):
+        """point loop of list_scan."""
+        from time import sleep
+        points = []
+        for wn in wavenumbers:
+            settle = self.tune(wn, tolerance=tolerance)
+            start = self._updated["awn"]
+            if self.timeline is not None:
+                self.timeline.add_step(start)
+            if callback is not None:
+                callback(wn, self.Stat.awn)
+            deadline = start + dwell
+            delay = deadline - monotonic()
+            if delay > 0:
+                sleep(delay)
+            end = monotonic()
+            if self.timeline is not None:
+                self.timeline.add_end(end)
+            points.append(self._point(wn=float(wn), awn=self.Stat.awn, settle=settle, start=start, end=end))
+        self.list_scan_points = tuple(points)
+        return self.list_scan_points
+
+    def list_scan(self, wavenumbers, dwell=1.0, tolerance=0.1, reorder=True, callback=None, asynchron=False):
+        """Visit an arbitrary list of wavenumbers.
+
+        The laser is tuned to each wavenumber with the tune function and stays there for dwell seconds, measured from the moment the laser
+        has settled (so the time of the callback and the queries do not add up). The dwell starts with the query of the real wavenumber,
+        which confirmed the new wavenumber. If reorder is True, the wavenumbers are visited in ascending
+        or descending order, starting with the end of the list nearer to the current wavenumber, which minimizes the total tuning distance
+        and therefore the tuning time. The callback is called with the wavenumber and the real wavenumber, as soon as the laser has settled
+        at a new wavenumber (e.g. to trigger a detector).
+
+        For each wavenumber a point tuple with the wavenumber, the real wavenumber, the settle time (None, if the laser did not settle) and
+        the start and end time (time.monotonic) of the dwell is stored in the list_scan_points tuple (and returned in the synchronous mode).
+        In the asynchronous mode the points are visited by a single background thread and the I/O worker is started (see start_worker).
+
+            >>> qcl.list_scan([1050.3, 1200.1, 1003.7], dwell=2.0)
+            (point(wn=1003.7, awn=1003.7, settle=0.21, start=..., end=...), ...)
+        """
+        wavenumbers = [float(wn) for wn in wavenumbers]
+        for wn in wavenumbers:
+            if wn < self._Range.wn[0] or wn > self._Range.wn[1]:
+                raise ValueError("{} is out of range!".format(str(wn)))
+        if reorder is True:
+            wavenumbers = self._visit_order(wavenumbers, self.cached("awn"))
 
         if asynchron is False:
-            from time import sleep
-            sleep(3)
+            return self._list_scan_points(wavenumbers, dwell, tolerance, callback)
+
+        else:
+            from threading import Thread
+            self.start_worker()
+            thread = Thread(target=self._list_scan_points, args=(wavenumbers, dwell, tolerance, callback), name="qcl-list-scan")
+            thread.daemon = True
+            thread.start()
+
+
+for _entry in QCL._Registry:
+    setattr(QCL, "get_" + _entry.name, _getter(_entry))
+    if _entry.set is not None:
+        setattr(QCL, "set_" + _entry.name, _setter(_entry))
+
+
+class TuningModel(object):
+
+    """Model of the time the laser needs to settle at a new wavenumber.
+
+    The settle time is modeled as offset + distance / speed, with the tuning distance in cm-1. Both parameters are fitted by linear least
+    squares to the observed settle times, which are weighted with decay ** age (age in observations), so the model follows a laser, whose
+    behaviour changes over time. Until the observations are sufficient for a fit, the given default values are used.
+
+        >>> qcl.tuning.predict(50.0)
+        0.52
+        >>> qcl.tuning.offset, qcl.tuning.speed
+    """
+
+    def __init__(self, offset=0.0, speed=100.0, decay=0.95):
+        super(TuningModel, self).__init__()
+        self.offset = offset             # settle time in seconds independent of the distance
+        self.speed = speed               # tuning speed in cm-1/s
+        self.decay = decay               # weight factor of the previous observations per new observation
+        self.count = 0
+        self._sums = [0.0, 0.0, 0.0, 0.0, 0.0]  # weighted sum of 1, distance, time, distance * distance and distance * time
+
+    def observe(self, distance, time):
+        """add an observed settle time and update the model."""
+        self.count += 1
+        sums = self._sums
+        for i, value in enumerate((1.0, distance, time, distance * distance, distance * time)):
+            sums[i] = self.decay * sums[i] + value
+        weight = sums[0]
+        variance = weight * sums[3] - sums[1] * sums[1]
+        if self.count < 2 or variance <= 1e-9 * max(sums[3], 1.0):
+            return
+        slope = (weight * sums[4] - sums[1] * sums[2]) / variance
+        if slope <= 0:
+            return
+        self.speed = 1.0 / slope
+        self.offset = max((sums[2] - slope * sums[1]) / weight, 0.0)
+
+    def predict(self, distance):
+        """return the expected settle time in seconds for a tuning distance in cm-1."""
+        return self.offset + abs(distance) / self.speed
+
+
+class ScanMonitor(object):
+
+    """Watches a running scan and signals its end.
+
+    The monitor queries the scancount and the real wavenumber of the laser. The remaining scan time is predicted from the estimated scan
+    duration (see QCL.estimate_scan_time) and, as soon as the scan has progressed, from the observed progress of the real wavenumber
+    between start and stop wavenumber (in scanmode 4 back and forth, the direction is taken from the previous query). The laser is then
+    queried again after half of the remaining time, limited by min_interval and max_interval. So early in a long scan only few queries are
+    send, while the end of the scan is detected within min_interval. If the scan takes longer than predicted, the interval grows again with
+    the time past the prediction, so a wrong estimate does not lead to a flood of queries.
+
+    A scancount of 0 is only interpreted as end of the scan, after a running scan was observed or start_delay seconds have passed. This
+    prevents issues, when the monitor is started directly after the scan-start function.
+
+    The end of the scan is signaled in three ways:
+        future    : a concurrent.futures.Future, which returns the final Stat tuple
+        event     : a threading.Event, which is set
+        callbacks : all functions added with add_callback() are called with the final Stat tuple
+
+        >>> qcl.scan_start()
+        >>> monitor = ScanMonitor(qcl)
+        >>> monitor.add_callback(lambda stat: print("finished"))
+        >>> monitor.start()
+        >>> monitor.event.wait()
+    """
+
+    def __init__(self, qcl, min_interval=0.05, max_interval=3.0, start_delay=3.0):
+        from concurrent.futures import Future
+        from threading import Event
+        super(ScanMonitor, self).__init__()
+        self.qcl = qcl
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.start_delay = start_delay
+        self.future = Future()
+        self.event = Event()
+        self.remaining = None            # last prediction of the remaining scan time in seconds
+        self.polls = 0                   # number of queries send to the laser
+        self._awn = None                 # real wavenumber of the previous query (direction of scanmode 4)
+        self._cancel = Event()
+        self._thread = None
+
+    def add_callback(self, callback):
+        """call callback(stat) with the final Stat tuple, when the scan is finished."""
+        def done(future):
+            if not future.cancelled() and future.exception() is None:
+                callback(future.result())
+        self.future.add_done_callback(done)
+
+    def start(self):
+        """watch the scan in a background thread (the I/O worker of the QCL is started, see QCL.start_worker)."""
+        from threading import Thread
+        self.qcl.start_worker()
+        self._thread = Thread(target=self._run_background, name="qcl-scan-monitor")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _run_background(self):
+        try:
+            self.run()
+        except Exception:
+            pass                         # the error is available from the future
+
+    def cancel(self):
+        """stop watching the scan (the scan itself is not stopped)."""
+        self._cancel.set()
+
+    def _predict(self, elapsed, scancount, awn):
+        """predict the remaining scan time from the scan progress."""
+        stat = self.qcl.Stat
+        try:
+            estimate = self.qcl.estimate_scan_time()
+        except (TypeError, ZeroDivisionError):
+            return self.max_interval
+        span = abs(stat.stopwn - stat.startwn)
+        previous, self._awn = self._awn, awn
+        if stat.mode in (1, 2, 3, 4) and span > 0 and scancount > 0:
+            position = min(abs(awn - stat.startwn) / span, 1.0)
+            if stat.mode == 4:           # forward sweep in the first, backward sweep in the second half of a cycle
+                backward = previous is not None and abs(awn - stat.startwn) < abs(previous - stat.startwn)
+                position = 1.0 - position / 2.0 if backward else position / 2.0
+            progress = ((scancount - 1) + position) / stat.cycles
+            if progress > 0.05:
+                return elapsed * (1.0 - progress) / progress
+        return estimate - elapsed
+
+    def run(self):
+        """watch the scan in the current thread and return the final Stat tuple."""
+        start = monotonic()
+        running = False
+        try:
             while True:
-                self.get_scancount()
-                if self.Stat.scancount == 0:
+                values = self.qcl.get_batch(["scancount", "awn"])
+                self.polls += 1
+                elapsed = monotonic() - start
+                if values["scancount"] != 0:
+                    running = True
+                elif running or elapsed >= self.start_delay:
                     break
-                self.step_next()
-                sleep(interval)
+                if running:
+                    self.remaining = self._predict(elapsed, values["scancount"], values["awn"])
+                    delay = min(max(abs(self.remaining) / 2.0, self.min_interval), self.max_interval)
+                else:
+                    delay = min(self.min_interval * 4, self.start_delay - elapsed)
+                if self._cancel.wait(delay):
+                    self.future.cancel()
+                    self.event.set()
+                    return None
+        except Exception as error:
+            self.future.set_exception(error)
+            self.event.set()
+            raise
+        self.remaining = 0.0
+        if self.qcl.timeline is not None:
+            self.qcl.timeline.add_end(self.qcl._updated["scancount"])
+        self.future.set_result(self.qcl.Stat)
+        self.event.set()
+        return self.qcl.Stat
+
+
+class _LazyState(QCL._state):
+
+    """Stat tuple, which queries unknown values (None) from the laser on their first access (see the getall parameter of the QCL class)."""
+
+    def _replace(self, **values):
+        state = QCL._state._replace(self, **values)
+        state._qcl = self._qcl
+        return state
+
+
+def _lazy_field(index, name):
+    def field(self):
+        value = tuple.__getitem__(self, index)
+        if value is None and name in QCL._query._fields:
+            getattr(self._qcl.Get, name)()
+            value = tuple.__getitem__(self._qcl.Stat, index)
+        return value
+    return property(field, doc="{} (queried on first access)".format(name))
 
-        else:
-            from threading import Timer
-            timer = Timer(interval, asynchron_timer)
-            timer.start()
+
+for _index, _name in enumerate(QCL._state._fields):
+    setattr(_LazyState, _name, _lazy_field(_index, _name))
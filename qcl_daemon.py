@@ -0,0 +1,333 @@
+# -*- coding: UTF8 -*-
+
+"""qcl_daemon.py provides a local server, which shares one QCL connection between multiple clients.
+
+qcl_daemon.py
+=============
+
+Provides:
+1. The QCLDaemon class, which owns the connection to the laser and serves clients over a Unix or TCP socket.
+2. The QCLClient class, which connects to a running daemon.
+
+Only one process can open the serial port of the laser. The daemon keeps the port (and the known laser state) open for the whole session,
+so tools like GUIs, loggers or acquisition scripts can connect and disconnect without reopening the port. Identical queries of multiple
+clients, which arrive while the same query is still running, are answered by a single query to the laser. Clients can subscribe to changes
+of the Stat tuple instead of polling.
+
+The daemon can be started from the command line:
+
+    $ python qcl_daemon.py --port /dev/ttyUSB0 --unix /tmp/qcl.sock
+    $ python qcl_daemon.py --port /dev/ttyUSB0 --tcp 127.0.0.1:5025
+
+Protocol
+========
+
+Requests and answers are JSON objects, one per line. Each request contains an id, which is repeated in the answer, and a cmd:
+
+    {"id": 1, "cmd": "get", "name": "scancount"}          -> {"id": 1, "result": 3}
+    {"id": 2, "cmd": "set", "name": "wn", "value": 1080}   -> {"id": 2, "result": 1080.0}
+    {"id": 3, "cmd": "call", "name": "scan_start"}         -> {"id": 3, "result": null}
+    {"id": 4, "cmd": "stat"}                               -> {"id": 4, "result": {"wn": 1080.0, ...}}
+    {"id": 5, "cmd": "subscribe"}                          -> {"id": 5, "result": {"wn": 1080.0, ...}}
+
+Errors are answered with {"id": ..., "error": "message"}. Subscribed clients receive {"event": "stat", "changes": {...}} whenever values of
+the Stat tuple change.
+"""
+__author__ = "Arne Küderle"
+__copyright__ = "Copyright 2015, Arne Küderle"
+__version__ = "1.0"
+__maintainer__ = "Arne Küderle"
+__email__ = "a.kuederle@gmail.com"
+
+import json
+import socket
+import socketserver
+from concurrent.futures import Future
+from threading import Event, Lock, Thread
+
+from qcl_controller import QCL
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    """handles the requests of a single client connection."""
+
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        self.write_lock = Lock()
+
+    def send(self, message):
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def handle(self):
+        daemon = self.server.daemon
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                request = {}
+                try:
+                    request = json.loads(line.decode("utf-8"))
+                    result = daemon.dispatch(request, self)
+                    self.send({"id": request.get("id"), "result": result})
+                except Exception as error:
+                    self.send({"id": request.get("id"), "error": "{}: {}".format(type(error).__name__, error)})
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            daemon.unsubscribe(self)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+
+    """threading TCP server, which can be restarted on the same port directly after it was closed."""
+
+    allow_reuse_address = True
+
+
+class QCLDaemon(object):
+
+    """Serves a single QCL connection to multiple clients.
+
+    The QCL instance is used with its I/O worker (see QCL.start_worker), so commands of different clients never interleave on the serial port.
+    While clients are subscribed, the parameters given in poll are queried every poll_interval seconds, so the subscribers are informed
+    about changes of a running scan.
+
+    Usage example
+    =============
+
+        >>> daemon = QCLDaemon("/tmp/qcl.sock", qcl=QCL("/dev/ttyUSB0"))
+        >>> daemon.serve_forever()
+    """
+
+    calls = ("get_all", "scan_start", "scan_stop", "step_next", "refresh", "verify")
+
+    def __init__(self, address, qcl=None, port=0, poll=("scancount", "awn"), poll_interval=0.5, **kwargs):
+        super(QCLDaemon, self).__init__()
+        self.qcl = QCL(port, **kwargs) if qcl is None else qcl
+        self.qcl.start_worker()
+        self.poll = tuple(poll)
+        self.poll_interval = poll_interval
+        self._lock = Lock()
+        self._inflight = {}              # futures of running queries by parameter name
+        self._subscribers = set()
+        self._published = self.qcl.Stat
+        self._stop = Event()
+        if isinstance(address, str):
+            server_class = socketserver.ThreadingUnixStreamServer
+        else:
+            server_class = _TCPServer
+        self.server = server_class(address, _Handler)
+        self.server.daemon_threads = True
+        self.server.daemon = self
+        self._poller = Thread(target=self._run_poller, name="qcl-daemon-poller")
+        self._poller.daemon = True
+        self._poller.start()
+
+    def get(self, name):
+        """query a parameter, sharing the query with all other clients asking for the same parameter at the same time."""
+        with self._lock:
+            future = self._inflight.get(name)
+            owner = future is None
+            if owner:
+                future = self._inflight[name] = Future()
+        if not owner:
+            return future.result()
+        try:
+            future.set_result(getattr(self.qcl.Get, name)())
+        except Exception as error:
+            future.set_exception(error)
+        finally:
+            with self._lock:
+                del self._inflight[name]
+        self.publish()
+        return future.result()
+
+    def dispatch(self, request, client):
+        """execute a single request of a client and return the result."""
+        cmd = request.get("cmd")
+        name = request.get("name")
+        if cmd == "get":
+            if name not in QCL._query._fields[:-1]:
+                raise ValueError("unknown parameter {!r}".format(name))
+            return self.get(name)
+        if cmd == "set":
+            if name not in QCL._control._fields:
+                raise ValueError("unknown parameter {!r}".format(name))
+            result = getattr(self.qcl.Set, name)(request["value"])
+            self.publish()
+            return result
+        if cmd == "call":
+            if name not in self.calls:
+                raise ValueError("unknown function {!r}".format(name))
+            result = getattr(self.qcl, name)()
+            self.publish()
+            return self._stat() if name in ("get_all", "refresh") else result
+        if cmd == "stat":
+            return self._stat()
+        if cmd == "subscribe":
+            with self._lock:
+                self._subscribers.add(client)
+            return self._stat()
+        if cmd == "unsubscribe":
+            self.unsubscribe(client)
+            return None
+        raise ValueError("unknown command {!r}".format(cmd))
+
+    def _stat(self):
+        return self.qcl.Stat._asdict()
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._subscribers.discard(client)
+
+    def publish(self):
+        """send all changes of the Stat tuple since the last call to the subscribed clients."""
+        with self._lock:
+            stat = self.qcl.Stat
+            changes = dict((name, value) for name, value, old in zip(stat._fields, stat, self._published) if value != old)
+            self._published = stat
+            subscribers = list(self._subscribers)
+        if not changes:
+            return
+        for client in subscribers:
+            try:
+                client.send({"event": "stat", "changes": changes})
+            except (ConnectionError, OSError, ValueError):
+                self.unsubscribe(client)
+
+    def _run_poller(self):
+        """query the poll parameters periodically, while clients are subscribed."""
+        while not self._stop.wait(self.poll_interval):
+            if self._subscribers and self.poll:
+                try:
+                    self.qcl.get_batch(list(self.poll))
+                except Exception:
+                    continue
+                self.publish()
+
+    def serve_forever(self):
+        """serve clients until shutdown() is called."""
+        self.server.serve_forever()
+
+    def shutdown(self):
+        """stop serving and close the connection to the laser."""
+        self._stop.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self._poller.join()
+        self.qcl.close()
+        if isinstance(self.server.server_address, str):
+            import os
+            if os.path.exists(self.server.server_address):
+                os.remove(self.server.server_address)
+
+
+class QCLClient(object):
+
+    """Client of a QCLDaemon.
+
+    The address is the path of a Unix socket or a (host, port) tuple. Functions are called synchronously. Stat changes are delivered to the
+    callback passed to subscribe(), which is called from the receiving thread of the client.
+
+        >>> client = QCLClient("/tmp/qcl.sock")
+        >>> client.get("scancount")
+        >>> client.subscribe(lambda changes: print(changes))
+    """
+
+    def __init__(self, address, timeout=10.0):
+        super(QCLClient, self).__init__()
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.connect(address)
+        self._file = self._socket.makefile("rb")
+        self.timeout = timeout
+        self._lock = Lock()
+        self._counter = 0
+        self._pending = {}
+        self._callback = None
+        self._reader = Thread(target=self._run_reader, name="qcl-client")
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _run_reader(self):
+        try:
+            for line in self._file:
+                message = json.loads(line.decode("utf-8"))
+                if message.get("event") == "stat":
+                    if self._callback is not None:
+                        self._callback(message["changes"])
+                    continue
+                future = self._pending.pop(message.get("id"), None)
+                if future is None:
+                    continue
+                if "error" in message:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message["result"])
+        except (ConnectionError, OSError, ValueError):
+            pass
+        for future in list(self._pending.values()):
+            future.set_exception(ConnectionError("connection to the daemon was closed"))
+
+    def request(self, cmd, **kwargs):
+        """send a request to the daemon and return its result."""
+        future = Future()
+        with self._lock:
+            self._counter += 1
+            self._pending[self._counter] = future
+            self._socket.sendall((json.dumps(dict(kwargs, id=self._counter, cmd=cmd)) + "\n").encode("utf-8"))
+        return future.result(self.timeout)
+
+    def get(self, name):
+        """get a parameter of the laser."""
+        return self.request("get", name=name)
+
+    def set(self, name, value):
+        """set a parameter of the laser."""
+        return self.request("set", name=name, value=value)
+
+    def call(self, name):
+        """call one of the functions listed in QCLDaemon.calls (e.g. scan_start)."""
+        return self.request("call", name=name)
+
+    def stat(self):
+        """get the Stat tuple of the daemon as dictionary (without querying the laser)."""
+        return self.request("stat")
+
+    def subscribe(self, callback):
+        """call callback(changes) on every change of the Stat tuple and return the current Stat as dictionary."""
+        self._callback = callback
+        return self.request("subscribe")
+
+    def close(self):
+        self._socket.close()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Share one QCL connection between multiple clients.")
+    parser.add_argument("--port", default=0, help="serial port of the laser")
+    parser.add_argument("--unix", help="path of the Unix socket to serve on")
+    parser.add_argument("--tcp", help="host:port to serve on")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="interval in seconds to poll scancount and awn for subscribers")
+    args = parser.parse_args(argv)
+    if args.tcp:
+        host, port = args.tcp.rsplit(":", 1)
+        address = (host, int(port))
+    else:
+        address = args.unix or "/tmp/qcl.sock"
+    daemon = QCLDaemon(address, port=args.port, poll_interval=args.poll_interval)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.shutdown()
+
+
+if __name__ == "__main__":
+    main()
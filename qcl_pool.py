@@ -0,0 +1,151 @@
+# -*- coding: UTF8 -*-
+
+"""qcl_pool.py provides the concurrent control of multiple QCLs.
+
+qcl_pool.py
+===========
+
+Provides the QCLPool class, which manages the connections to several laser controllers (e.g. on different serial ports) and runs
+commands on all of them at the same time using a thread pool. Therefore the time to configure or query all lasers is about the time
+of the slowest laser instead of the sum of all lasers.
+"""
+__author__ = "Arne Küderle"
+__copyright__ = "Copyright 2015, Arne Küderle"
+__version__ = "1.0"
+__maintainer__ = "Arne Küderle"
+__email__ = "a.kuederle@gmail.com"
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier, Lock
+from time import monotonic
+
+from qcl_controller import QCL
+
+
+class QCLPool(object):
+
+    """Pool of QCL connections, which are controlled concurrently.
+
+    The lasers are stored in the lasers dictionary. If a list of ports is given, the port is used as name of each laser, otherwise
+    a dictionary of names and ports can be passed. Already opened QCL instances can be added with the qcls parameter. All further
+    keyword arguments are passed to the QCL class.
+
+    Usage example
+    =============
+
+        >>> pool = QCLPool(["/dev/ttyUSB0", "/dev/ttyUSB1"])
+        >>> pool.apply_recipe(pool.recipe(startwn=1000, stopwn=1200, mode=3))
+        >>> pool.coordinated_start()
+        {'/dev/ttyUSB0': 0.0, '/dev/ttyUSB1': 0.00012}
+        >>> pool.wait_for_finish()
+        >>> pool.close()
+
+    All functions return a dictionary with the result of each laser. If a command fails for one laser, the commands of all other lasers
+    are still finished before the first error is raised. If a port can not be opened, all other ports are closed again.
+    """
+
+    def __init__(self, ports=(), qcls=None, **kwargs):
+        super(QCLPool, self).__init__()
+        if not isinstance(ports, dict):
+            ports = dict((port, port) for port in ports)
+        self.lasers = dict(qcls or {})
+        self._lock = Lock()
+        self._workers = max(len(ports) + len(self.lasers), 1)
+        self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="qcl-pool")
+        opened = {}
+        try:
+            self._run(lambda port: QCL(port, **kwargs), ports, opened)
+        except Exception:
+            for qcl in opened.values():
+                try:
+                    qcl.close()
+                except Exception:
+                    pass
+            self._executor.shutdown()
+            raise
+        self.lasers.update(opened)
+
+    def _executor_for(self, count):
+        """return the thread pool, enlarged to at least count threads, so all calls of a _run are executed at the same time."""
+        with self._lock:
+            if count > self._workers:
+                self._executor.shutdown(wait=False)
+                self._workers = count
+                self._executor = ThreadPoolExecutor(max_workers=count, thread_name_prefix="qcl-pool")
+            return self._executor
+
+    def _run(self, function, arguments, results=None):
+        """call the function for all items of the arguments dictionary concurrently and return a dictionary of the results.
+
+        If a results dictionary is passed, the successful results are stored in it, even if another call fails.
+        """
+        executor = self._executor_for(len(arguments))
+        futures = dict((name, executor.submit(function, argument)) for name, argument in arguments.items())
+        results = {} if results is None else results
+        error = None
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as exception:
+                error = error or exception
+        if error is not None:
+            raise error
+        return results
+
+    def map(self, function, *args, **kwargs):
+        """call function(qcl, *args, **kwargs) for all lasers concurrently and return a dictionary of the results."""
+        return self._run(lambda qcl: function(qcl, *args, **kwargs), self.lasers)
+
+    def get_all(self):
+        """get the full laser state of all lasers."""
+        return self.map(QCL.get_all)
+
+    def recipe(self, **values):
+        """create a validated scan recipe (see QCL.recipe)."""
+        return QCL.recipe(next(iter(self.lasers.values())), **values)
+
+    def apply_recipe(self, recipe, verify=True):
+        """apply a scan recipe to all lasers (see QCL.apply_recipe).
+
+        Instead of a single recipe, a dictionary with a recipe for each laser name can be passed.
+        """
+        if isinstance(recipe, dict):
+            return self._run(lambda item: item[0].apply_recipe(item[1], verify=verify), dict((name, (self.lasers[name], value)) for name, value in recipe.items()))
+        return self.map(QCL.apply_recipe, recipe, verify=verify)
+
+    def scan_start(self):
+        """start the scans of all lasers."""
+        return self.map(QCL.scan_start)
+
+    def scan_stop(self):
+        """stop the scans of all lasers."""
+        return self.map(QCL.scan_stop)
+
+    def coordinated_start(self):
+        """start the scans of all lasers within a tight time window.
+
+        All pool threads wait at a barrier, until every thread is ready, and then send the start command at the same time. A dictionary
+        with the time offset in seconds of each start command relative to the earliest one is returned.
+        """
+        lasers = dict(self.lasers)
+        barrier = Barrier(len(lasers))
+
+        def start(qcl):
+            barrier.wait()
+            qcl.scan_start()
+            return monotonic()
+
+        times = self._run(start, lasers)
+        first = min(times.values())
+        return dict((name, value - first) for name, value in times.items())
+
+    def wait_for_finish(self, interval=3.0):
+        """block until the scans of all lasers are finished (see QCL.wait_for_finish)."""
+        return self.map(QCL.wait_for_finish, interval=interval)
+
+    def close(self):
+        """close all connections and the thread pool."""
+        try:
+            self.map(QCL.close)
+        finally:
+            self._executor.shutdown()
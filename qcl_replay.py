@@ -0,0 +1,166 @@
+# -*- coding: UTF8 -*-
+
+"""qcl_replay.py provides transports to record and replay the communication with the QCL.
+
+qcl_replay.py
+=============
+
+Provides:
+1. The RecordingTransport class, which wraps a transport (e.g. serial.Serial) and records every write and read with a timestamp.
+2. The ReplayTransport class, which feeds a recorded transcript back to the QCL class at the original or an accelerated speed.
+
+Transcripts are JSON lines files. Each line contains the monotonic timestamp (t), the direction ("w" for data send to the laser, "r" for
+data received from the laser) and the raw data (decoded as latin-1, so every byte is preserved). Files written by QCL.log_to() can be
+replayed as well.
+
+Usage example
+=============
+
+    >>> qcl = QCL()
+    >>> qcl.record("session.jsonl")
+    >>> ...
+    >>> qcl.close()
+
+    # later on
+    >>> from qcl_replay import ReplayTransport
+    >>> qcl = QCL(transport=ReplayTransport("session.jsonl", speed=10.0))
+"""
+__author__ = "Arne Küderle"
+__copyright__ = "Copyright 2015, Arne Küderle"
+__version__ = "1.0"
+__maintainer__ = "Arne Küderle"
+__email__ = "a.kuederle@gmail.com"
+
+import json
+from collections import deque
+from time import monotonic, sleep
+
+
+class RecordingTransport(object):
+
+    """Wraps a transport and records all data written to or read from it in a transcript file.
+
+    The file is line buffered, so every record is written immediately and the transcript is complete up to a crash of the session.
+    """
+
+    def __init__(self, transport, file):
+        super(RecordingTransport, self).__init__()
+        self.transport = transport
+        self._file = open(file, "a", buffering=1)
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+    def _record(self, direction, data):
+        self._file.write(json.dumps({"t": monotonic(), "d": direction, "data": data.decode("latin-1")}) + "\n")
+
+    def write(self, data):
+        self._record("w", bytes(data))
+        return self.transport.write(data)
+
+    @property
+    def in_waiting(self):
+        return self.transport.in_waiting
+
+    def read(self, size=1):
+        data = self.transport.read(size)
+        if data:
+            self._record("r", data)
+        return data
+
+    def stop(self):
+        """stop recording and return the wrapped transport."""
+        self._file.close()
+        return self.transport
+
+    def close(self):
+        self._file.close()
+        self.transport.close()
+
+
+def load_transcript(file):
+    """load a transcript (written by RecordingTransport or QCL.log_to) as a list of (timestamp, direction, data) tuples."""
+    events = []
+    with open(file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "msg" in entry:
+                direction = "w" if entry["msg"].startswith(">>> ") else "r"
+                events.append((entry["monotonic"], direction, entry["msg"][4:].encode("latin-1")))
+            else:
+                events.append((entry["t"], entry["d"], entry["data"].encode("latin-1")))
+    return events
+
+
+class ReplayTransport(object):
+
+    """Transport, which answers with the data of a recorded transcript.
+
+    Every write is compared with the recorded data send to the laser. The recorded answers following this data become readable with the
+    same delay as in the recording, divided by the speed factor (speed=float("inf") makes them readable immediately). If strict is True, a
+    ValueError is raised, if the written data differs from the recording.
+    """
+
+    def __init__(self, transcript, speed=1.0, strict=True, timeout=1.0):
+        super(ReplayTransport, self).__init__()
+        self.events = load_transcript(transcript) if isinstance(transcript, str) else list(transcript)
+        self.speed = speed
+        self.strict = strict
+        self.timeout = timeout
+        self.is_open = True
+        self._index = 0                  # next event of the transcript
+        self._anchor = 0.0               # recorded time of the last consumed write
+        self._expected = b""             # recorded data send to the laser, which was not written yet
+        self._pending = deque()          # answers as [time when readable, remaining bytes]
+
+    @property
+    def finished(self):
+        """True, if all events of the transcript are replayed."""
+        return self._index >= len(self.events) and not self._pending
+
+    def write(self, data):
+        data = bytes(data)
+        now = monotonic()
+        while len(self._expected) < len(data) and self._index < len(self.events) and self.events[self._index][1] == "w":
+            self._anchor, _, chunk = self.events[self._index]
+            self._expected += chunk
+            self._index += 1
+        if self.strict and not self._expected.startswith(data):
+            raise ValueError("written data {!r} differs from the recording {!r}".format(data, self._expected[:len(data)]))
+        self._expected = self._expected[len(data):]
+        while self._index < len(self.events) and self.events[self._index][1] == "r":
+            timestamp, _, chunk = self.events[self._index]
+            self._pending.append([now + max(timestamp - self._anchor, 0.0) / self.speed, chunk])
+            self._index += 1
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        now = monotonic()
+        return sum(len(data) for ready, data in self._pending if ready <= now)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else monotonic() + self.timeout
+        out = b""
+        while len(out) < size:
+            now = monotonic()
+            while self._pending and self._pending[0][0] <= now and len(out) < size:
+                chunk = self._pending[0]
+                data = chunk[1][:size - len(out)]
+                out += data
+                chunk[1] = chunk[1][len(data):]
+                if not chunk[1]:
+                    self._pending.popleft()
+            if len(out) >= size or not self._pending or (deadline is not None and now >= deadline):
+                break
+            wake = self._pending[0][0] if deadline is None else min(self._pending[0][0], deadline)
+            sleep(max(wake - now, 0.0))
+        return out
+
+    def reset_input_buffer(self):
+        self._pending.clear()
+
+    def close(self):
+        self.is_open = False
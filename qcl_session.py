@@ -0,0 +1,183 @@
+# -*- coding: UTF8 -*-
+
+"""qcl_session.py provides an append-only store for everything a QCL session produces.
+
+qcl_session.py
+==============
+
+Provides:
+1. The SessionStore class, which appends command events, Stat snapshots and telemetry samples to memory-mapped files.
+2. The load_session function, which reads a store (also while it is written by another process).
+
+A store is a directory. Each table (events, states, telemetry) is stored column by column: every column is a file of fixed-width values,
+which is memory-mapped and grows in chunks. The number of valid records of each table is kept in a separate count file. The count is only
+increased after the records are flushed, so a reader (or a session restarted after a crash) never sees incomplete records. The memory usage
+of a session is constant, independent of its duration.
+
+Usage example
+=============
+
+    >>> qcl = QCL()
+    >>> qcl.store_to("session")
+    >>> ...
+    >>> qcl.close()
+
+    # in another process
+    >>> from qcl_session import load_session
+    >>> session = load_session("session")
+    >>> session["states"]["time"], session["states"]["awn"]
+    >>> session["events"]["data"][session["events"]["direction"] == b"w"]
+"""
+__author__ = "Arne Küderle"
+__copyright__ = "Copyright 2015, Arne Küderle"
+__version__ = "1.0"
+__maintainer__ = "Arne Küderle"
+__email__ = "a.kuederle@gmail.com"
+
+import json
+import os
+from threading import Event, Lock, Thread
+
+from qcl_controller import QCL
+
+
+# columns of each table as (name, NumPy type)
+SCHEMA = {
+    "events": [("time", "<f8"), ("direction", "S1"), ("data", "S40")],
+    "states": [("time", "<f8")] + [(name, "<f8") for name in QCL._state._fields],
+    "telemetry": [("time", "<f8"), ("awn", "<f8"), ("scancount", "<i4")],
+}
+
+
+def _path(directory, table, column):
+    return os.path.join(directory, "{}.{}".format(table, column))
+
+
+class _Table(object):
+
+    """append-only table, which stores each column in its own memory-mapped file."""
+
+    def __init__(self, directory, name, columns, chunk):
+        import numpy as np
+        self.directory = directory
+        self.name = name
+        self.columns = columns
+        self.chunk = chunk
+        count_file = _path(directory, name, "count")
+        if not os.path.exists(count_file):
+            with open(count_file, "wb") as f:
+                f.write(b"\0" * 8)
+        self._count = np.memmap(count_file, dtype="<u8", mode="r+", shape=(1,))
+        self.written = int(self._count[0])       # records written to the files (the count file is updated on flush)
+        self.capacity = 0
+        self._arrays = []
+        self._grow(self.written + chunk)
+
+    def _grow(self, capacity):
+        """extend all column files to the given number of records and map them again."""
+        import numpy as np
+        arrays = []
+        for column, dtype in self.columns:
+            size = capacity * np.dtype(dtype).itemsize
+            with open(_path(self.directory, self.name, column), "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+            arrays.append(np.memmap(_path(self.directory, self.name, column), dtype=dtype, mode="r+", shape=(capacity,)))
+        self._arrays = arrays
+        self.capacity = capacity
+
+    def append(self, values):
+        if self.written >= self.capacity:
+            self.flush()
+            self._grow(self.capacity + self.chunk)
+        for array, value in zip(self._arrays, values):
+            array[self.written] = value
+        self.written += 1
+
+    def flush(self):
+        """write all records to disk and make them visible for readers."""
+        if self.written == self._count[0]:
+            return
+        for array in self._arrays:
+            array.flush()
+        self._count[0] = self.written
+        self._count.flush()
+
+
+class SessionStore(object):
+
+    """Append-only, memory-mapped store of a QCL session.
+
+    The store contains three tables:
+        events    : time, direction ("w" for commands, "r" for answers) and data of each line send to or received from the laser
+        states    : time and all values of the Stat tuple (NaN for unknown values) on every update of the Stat tuple
+        telemetry : time, real wavenumber and scancount of the samples of a TelemetryRecorder
+
+    All times are time.monotonic timestamps. Data of an event is truncated to 40 characters. The records are flushed every flush_interval
+    seconds by a background thread (and on flush() or close()). An existing store is continued.
+    """
+
+    def __init__(self, directory, flush_interval=1.0, chunk=65536):
+        super(SessionStore, self).__init__()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, "schema.json"), "w") as f:
+            json.dump(SCHEMA, f)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = Lock()
+        self._tables = dict((name, _Table(directory, name, columns, chunk)) for name, columns in SCHEMA.items())
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name="qcl-session-flush")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return sum(table.written for table in self._tables.values())
+
+    def add_event(self, time, direction, data):
+        """add the lines of a command (direction "w") or an answer (direction "r")."""
+        direction = direction.encode("ascii")
+        with self._lock:
+            for line in data.splitlines() or [""]:
+                self._tables["events"].append((time, direction, line.encode("ascii", "replace")))
+
+    def add_state(self, time, state):
+        """add a snapshot of the Stat tuple."""
+        values = [float("nan") if value is None else value for value in tuple.__iter__(state)]
+        with self._lock:
+            self._tables["states"].append([time] + values)
+
+    def add_telemetry(self, time, awn, scancount):
+        """add a telemetry sample."""
+        with self._lock:
+            self._tables["telemetry"].append((time, awn, scancount))
+
+    def flush(self):
+        """write all records to disk and make them visible for readers."""
+        with self._lock:
+            for table in self._tables.values():
+                table.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """stop the flush thread and flush all records."""
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+
+def load_session(directory):
+    """load all flushed records of a store as dictionary of tables, each a dictionary of read-only NumPy arrays (memory-mapped)."""
+    import numpy as np
+    with open(os.path.join(directory, "schema.json")) as f:
+        schema = json.load(f)
+    session = {}
+    for table, columns in schema.items():
+        count = int(np.fromfile(_path(directory, table, "count"), dtype="<u8", count=1)[0])
+        session[table] = dict((column, np.memmap(_path(directory, table, column), dtype=dtype, mode="r", shape=(count,)) if count
+                               else np.zeros(0, dtype=dtype)) for column, dtype in columns)
+    return session
@@ -0,0 +1,314 @@
+# -*- coding: UTF8 -*-
+
+"""qcl_simulator.py provides a software simulation of the daylight solution QCL controller.
+
+qcl_simulator.py
+================
+
+Provides:
+1. The SimulatedLaser class, which answers the serial commands used by the QCL class (:laser:, :pulse:, :scan: and :info: commands)
+   and simulates the tuning of the laser and the progression of scans over time.
+2. The SimulatedSerial class, an in-process transport with the interface of serial.Serial, which can be passed to QCL(transport=...).
+3. The PtyServer class, which serves a SimulatedLaser on a pseudo terminal, so it can be opened like a real serial port (Linux only).
+
+Usage example
+=============
+
+    >>> from qcl_controller import QCL
+    >>> from qcl_simulator import SimulatedLaser, SimulatedSerial
+    >>> laser = SimulatedLaser(tuning_speed=200.0)
+    >>> qcl = QCL(transport=SimulatedSerial(laser, latency=0.005))
+
+    # or using a pseudo terminal
+    >>> server = PtyServer(laser)
+    >>> qcl = QCL(port=server.port)
+"""
+__author__ = "Arne Küderle"
+__copyright__ = "Copyright 2015, Arne Küderle"
+__version__ = "1.0"
+__maintainer__ = "Arne Küderle"
+__email__ = "a.kuederle@gmail.com"
+
+from collections import deque
+from time import monotonic, sleep
+
+from qcl_controller import QCL
+
+
+class SimulatedLaser(object):
+
+    """Simulation of the laser controller on the level of the serial protocol.
+
+    The handle() function takes a single command line and returns the answer of the controller (or None for commands without answer).
+    The answers use the same format (value, unit and line end) as the real controller.
+
+    Simulation details
+    ==================
+
+    tuning_speed : speed in cm-1/s with which the laser moves to a new wavenumber (set with :laser:set or in stepscans)
+    rate_scale   : sweep speed in cm-1/s per unit of the scanrate parameter
+
+    Scans are simulated for all four scanmodes. While a scan is running, the scancount is the number of the current cycle (starting with 1)
+    and 0 after all cycles are finished. In the automatic stepscan (mode 1) the laser stays for pause seconds at each wavenumber. In the
+    manual stepscan (mode 2) the laser only moves to the next wavenumber on the :scan:step:next command.
+    All values are checked against the ranges of the QCL class. Values out of range are ignored, like by the real controller.
+    """
+
+    _answers = {":laser:set?": ("wn", "{:07.2f}cm-1"), ":pulse:freq?": ("freq", "{:05.1f}kHz"), ":pulse:width?": ("pw", "{:05.3f}usec"),
+                ":scan:start?": ("startwn", "{:07.2f}cm-1"), ":scan:stop?": ("stopwn", "{:07.2f}cm-1"), ":scan:rate?": ("rate", "{:.0f}"),
+                ":scan:cycles?": ("cycles", "{:.0f}"), ":scan:mode?": ("mode", "{:d}"), ":scan:pause?": ("pause", "{:04.1f}sec"),
+                ":scan:step?": ("step", "{:05.2f}cm-1"), ":info:hhrs?": ("whours", "{:06.1f}hrs")}
+    _settings = dict((command.split(" ")[0], name) for name, command in zip(QCL._Commands._fields, QCL._Commands) if command is not None)
+
+    def __init__(self, tuning_speed=100.0, rate_scale=10.0, clock=monotonic, **state):
+        super(SimulatedLaser, self).__init__()
+        self.tuning_speed = float(tuning_speed)
+        self.rate_scale = float(rate_scale)
+        self.clock = clock
+        self.wn = 1080.0
+        self.freq = 100.0
+        self.pw = 0.5
+        self.startwn = 990.0
+        self.stopwn = 1240.0
+        self.rate = 3.0
+        self.cycles = 1.0
+        self.mode = 3
+        self.pause = 1.0
+        self.step = 25.0
+        self.whours = 1234.5
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.commands = 0                # number of handled commands
+        self._tune_from = self.wn        # wavenumber at the start of the current tuning
+        self._tune_start = clock()
+        self._running = False
+        self._scan_start = None
+        self._index = 0                  # current wavenumber of the manual stepscan
+        self._cycle = 0                  # current cycle of the manual stepscan
+
+    def handle(self, line):
+        """process a single command line and return the answer string (or None)."""
+        self.commands += 1
+        line = line.strip()
+        now = self.clock()
+        if line in self._answers:
+            name, form = self._answers[line]
+            return form.format(getattr(self, name)) + "\r\n"
+        if line == ":scan:count?":
+            return "{:04d}\r\n".format(self._position(now)[1])
+        if line == ":laser:pos?":
+            return "{:07.2f}cm-1\r\n".format(self._position(now)[0])
+        if line == ":scan:run 1":
+            self._position(now)
+            self._running = True
+            self._scan_start = now
+            self._index = 0
+            self._cycle = 0
+        elif line == ":scan:run 0":
+            self._finish(now)
+        elif line == ":scan:step:next":
+            self._next(now)
+        elif " " in line:
+            command, value = line.rsplit(" ", 1)
+            name = self._settings.get(command)
+            if name is not None:
+                self._apply(name, value, now)
+        return None
+
+    def _apply(self, name, value, now):
+        """set a parameter, if the value is valid."""
+        try:
+            value = float(value)
+        except ValueError:
+            return
+        if value < getattr(QCL._Range, name)[0] or value > getattr(QCL._Range, name)[1]:
+            return
+        if name == "wn":
+            self._tune_from = self._position(now)[0]
+            self._tune_start = now
+        setattr(self, name, int(value) if name == "mode" else value)
+
+    def _finish(self, now):
+        """stop a running scan at the current wavenumber."""
+        if self._running:
+            self._tune_from = self._position(now)[0]
+            self._tune_start = now
+            self._running = False
+
+    def _points(self):
+        """number of wavenumbers of a stepscan."""
+        return int(abs(self.stopwn - self.startwn) / self.step + 1e-9) + 1
+
+    def _next(self, now):
+        """jump to the next wavenumber of a manual stepscan."""
+        if not (self._running and self.mode == 2):
+            return
+        self._index += 1
+        if self._index >= self._points():
+            self._index = 0
+            self._cycle += 1
+            if self._cycle >= self.cycles:
+                self._tune_from = self.startwn + self._direction() * (self._points() - 1) * self.step
+                self._tune_start = now
+                self._running = False
+
+    def _direction(self):
+        return 1.0 if self.stopwn >= self.startwn else -1.0
+
+    def _position(self, now):
+        """return the current wavenumber and scancount (and end scans, which are finished by now)."""
+        if not self._running:
+            distance = self.wn - self._tune_from
+            moved = min(abs(distance), (now - self._tune_start) * self.tuning_speed)
+            return self._tune_from + (moved if distance >= 0 else -moved), 0
+        span = abs(self.stopwn - self.startwn)
+        direction = self._direction()
+        elapsed = now - self._scan_start
+        if self.mode == 2:
+            return self.startwn + direction * self._index * self.step, self._cycle + 1
+        if self.mode == 1:
+            dwell = self.step / self.tuning_speed + self.pause
+            duration = self._points() * dwell
+        else:
+            speed = self.rate * self.rate_scale
+            duration = max(span / speed, 1e-6) * (2 if self.mode == 4 else 1)
+        cycle = int(elapsed / duration)
+        if cycle >= self.cycles:
+            if self.mode == 1:
+                self._tune_from = self.startwn + direction * (self._points() - 1) * self.step
+            else:
+                self._tune_from = self.stopwn if self.mode == 3 else self.startwn
+            self._tune_start = self._scan_start + self.cycles * duration
+            self._running = False
+            return self._position(now)
+        offset = elapsed - cycle * duration
+        if self.mode == 1:
+            position = min(int(offset / dwell), self._points() - 1) * self.step
+        elif self.mode == 3:
+            position = offset * speed
+        else:
+            position = span - abs(span - offset * speed)
+        return self.startwn + direction * position, cycle + 1
+
+
+class SimulatedSerial(object):
+
+    """In-process transport with the interface of serial.Serial, which is connected to a SimulatedLaser.
+
+    Answers become readable after the given latency (in seconds) plus the transmission time of the command and the answer at the given baudrate.
+    Like a real serial port, read() blocks until the requested number of bytes is available or the timeout is reached.
+    """
+
+    def __init__(self, laser=None, latency=0.0, baudrate=115200, timeout=1.0):
+        super(SimulatedSerial, self).__init__()
+        self.laser = SimulatedLaser() if laser is None else laser
+        self.latency = latency
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.is_open = True
+        self._line = b""                 # incomplete command line
+        self._pending = deque()          # answers as [time when readable, remaining bytes]
+
+    def _transmission(self, size):
+        return size * 10.0 / self.baudrate
+
+    def write(self, data):
+        data = bytes(data)
+        now = monotonic() + self._transmission(len(data))
+        self._line += data
+        while b"\n" in self._line:
+            line, _, self._line = self._line.partition(b"\n")
+            answer = self.laser.handle(line.decode("ascii", "replace"))
+            if answer:
+                ready = max(now + self.latency, self._pending[-1][0] if self._pending else 0.0) + self._transmission(len(answer))
+                self._pending.append([ready, answer.encode("ascii")])
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        now = monotonic()
+        return sum(len(data) for ready, data in self._pending if ready <= now)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else monotonic() + self.timeout
+        out = b""
+        while len(out) < size:
+            now = monotonic()
+            while self._pending and self._pending[0][0] <= now and len(out) < size:
+                chunk = self._pending[0]
+                data = chunk[1][:size - len(out)]
+                out += data
+                chunk[1] = chunk[1][len(data):]
+                if not chunk[1]:
+                    self._pending.popleft()
+            if len(out) >= size:
+                break
+            wake = self._pending[0][0] if self._pending else float("inf")
+            if deadline is not None:
+                wake = min(wake, deadline)
+            if wake == float("inf") or (deadline is not None and now >= deadline):
+                break
+            sleep(max(wake - now, 0.0))
+        return out
+
+    def reset_input_buffer(self):
+        self._pending.clear()
+
+    def close(self):
+        self.is_open = False
+
+
+class PtyServer(object):
+
+    """Serves a SimulatedLaser on a pseudo terminal (Linux only).
+
+    The path of the terminal, which can be opened with serial.Serial or QCL(port=...), is available as port attribute. The laser is served by a
+    background thread until close() is called. Like in the SimulatedSerial class, the answers become readable the given latency after their
+    command was received, so the answers of multiple commands send in a single write overlap.
+    """
+
+    def __init__(self, laser=None, latency=0.0):
+        import os
+        import tty
+        from threading import Thread
+        super(PtyServer, self).__init__()
+        self.laser = SimulatedLaser() if laser is None else laser
+        self.latency = latency
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._thread = Thread(target=self._run, name="qcl-pty-server")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        import os
+        import select
+        line = b""
+        pending = deque()                # answers as (time when readable, bytes)
+        while self._running:
+            timeout = max(pending[0][0] - monotonic(), 0.0) if pending else 0.1
+            readable, _, _ = select.select([self._master], [], [], timeout)
+            if readable:
+                try:
+                    line += os.read(self._master, 1024)
+                except OSError:
+                    break
+                now = monotonic()
+                while b"\n" in line:
+                    command, _, line = line.partition(b"\n")
+                    answer = self.laser.handle(command.decode("ascii", "replace"))
+                    if answer:
+                        pending.append((max(now + self.latency, pending[-1][0] if pending else 0.0), answer.encode("ascii")))
+            now = monotonic()
+            while pending and pending[0][0] <= now:
+                os.write(self._master, pending.popleft()[1])
+
+    def close(self):
+        """stop serving and close the pseudo terminal."""
+        import os
+        self._running = False
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
@@ -0,0 +1,277 @@
+# -*- coding: UTF8 -*-
+
+"""qcl_telemetry.py provides tools to record the state of the QCL over time.
+
+qcl_telemetry.py
+================
+
+Provides:
+1. The TelemetryRecorder class, which periodically records the real wavenumber and the scancount of the laser into a fixed size ring buffer.
+2. The ScanTimeline class, which indexes the wavenumber of the laser over time, to assign detector samples to wavenumbers.
+
+All recorded data is stored in NumPy arrays.
+"""
+__author__ = "Arne Küderle"
+__copyright__ = "Copyright 2015, Arne Küderle"
+__version__ = "1.0"
+__maintainer__ = "Arne Küderle"
+__email__ = "a.kuederle@gmail.com"
+
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from qcl_controller import QCLError
+
+
+class TelemetryRecorder(object):
+
+    """Records the real wavenumber (awn) and the scancount of a QCL in a background thread.
+
+    The values are queried with the given rate (in Hz) and stored together with a timestamp (time.monotonic) in a preallocated NumPy
+    ring buffer. If the buffer is full, the oldest samples are overwritten, so the memory usage never grows during a measurement.
+
+    Usage example
+    =============
+
+        >>> recorder = TelemetryRecorder(qcl, rate=20, size=100000)
+        >>> recorder.start()
+        >>> qcl.scan_start()
+        >>> qcl.wait_for_finish()
+        >>> recorder.stop()
+        >>> data = recorder.snapshot()
+        >>> data["time"], data["awn"], data["scancount"]
+
+    The snapshot() function returns a chronologically ordered copy of all samples in the buffer. To avoid the copy, the views() function
+    returns views on the buffer itself. Please note, that these views are overwritten by the recorder, as long as it is running.
+    Since the recorder queries the laser from its own thread, start() starts the I/O worker of the QCL (see QCL.start_worker), so the queries
+    of the recorder and of other threads never interleave. Samples, which fail with a QCLError (e.g. a timeout), are skipped and counted in
+    the errors attribute.
+    To keep all samples of a long measurement, a SessionStore (see qcl_session) can be passed as session, to which every sample is appended.
+    """
+
+    dtype = [("time", "f8"), ("awn", "f8"), ("scancount", "i4")]
+
+    def __init__(self, qcl, rate=10.0, size=100000, session=None):
+        import numpy as np
+        super(TelemetryRecorder, self).__init__()
+        self.qcl = qcl
+        self.rate = float(rate)
+        self.size = int(size)
+        self.count = 0                   # total number of recorded samples (including overwritten ones)
+        self.errors = 0                  # number of samples, which failed with a QCLError
+        self.session = session           # SessionStore, to which all samples are appended as well (see qcl_session)
+        self._buffer = np.zeros(self.size, dtype=self.dtype)
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def start(self):
+        """start recording in a background thread."""
+        if self._thread is not None:
+            return
+        self.qcl.start_worker()
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="qcl-telemetry")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """stop recording."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        """polling loop of the recorder, which queries the laser at fixed deadlines."""
+        interval = 1.0 / self.rate
+        deadline = monotonic()
+        while not self._stop.is_set():
+            try:
+                values = self.qcl.get_batch(["awn", "scancount"])
+            except QCLError:
+                self.errors += 1
+            else:
+                self.append(monotonic(), values["awn"], values["scancount"])
+            deadline += interval
+            delay = deadline - monotonic()
+            if delay < 0:
+                deadline -= delay     # the laser is slower than the requested rate, continue without catching up
+                delay = 0
+            self._stop.wait(delay)
+
+    def append(self, time, awn, scancount):
+        """write a single sample into the ring buffer."""
+        with self._lock:
+            self._buffer[self.count % self.size] = (time, awn, scancount)
+            self.count += 1
+        if self.session is not None:
+            self.session.add_telemetry(time, awn, scancount)
+
+    def views(self):
+        """return the recorded samples as (at most two) views on the ring buffer in chronological order without copying them."""
+        with self._lock:
+            end = self.count % self.size
+            if self.count <= self.size:
+                return (self._buffer[:self.count],)
+            return (self._buffer[end:], self._buffer[:end])
+
+    def snapshot(self):
+        """return a chronologically ordered copy of all recorded samples."""
+        import numpy as np
+        with self._lock:
+            end = self.count % self.size
+            if self.count <= self.size:
+                return self._buffer[:self.count].copy()
+            return np.concatenate((self._buffer[end:], self._buffer[:end]))
+
+    def clear(self):
+        """remove all samples from the buffer."""
+        with self._lock:
+            self.count = 0
+
+
+class ScanTimeline(object):
+
+    """Index of the wavenumber emitted by the laser over time.
+
+    The timeline stores two kinds of events with their monotonic timestamp in growing NumPy arrays:
+        awn samples : every real wavenumber received from the laser (by get_awn, get_batch, wait_for_finish, man_scan, ...)
+        boundaries  : the start of a scan or a step (scan_start and step_next) and the end of a scan (scan_stop or a finished scan)
+
+    The timeline is filled by the QCL class, when it is assigned to its timeline attribute. The queries are vectorized (binary search
+    with numpy.searchsorted), so the wavenumbers of millions of detector timestamps can be looked up without a Python loop. The detector
+    timestamps must be taken with the same clock (time.monotonic).
+
+    Usage example
+    =============
+
+        >>> timeline = qcl.timeline = ScanTimeline()
+        >>> qcl.man_scan(asynchron=False)
+        >>> timeline.wavenumber_at(detector_times, steps=True)      # wavenumber of the step during each detector sample
+        >>> timeline.sample_ranges(detector_times)                  # first and last + 1 sample index of each step
+        >>> timeline.steps()["wn"]                                  # wavenumber of each step
+
+    For sweeps (scanmode 3 and 4) the awn samples can be interpolated instead:
+
+        >>> timeline.wavenumber_at(detector_times, interpolate=True)
+    """
+
+    def __init__(self, size=4096):
+        import numpy as np
+        super(ScanTimeline, self).__init__()
+        self._lock = Lock()
+        self._awn = np.zeros((2, size))                   # time and real wavenumber of each awn sample
+        self._awn_count = 0
+        self._bounds = np.zeros(size)                     # time of each boundary
+        self._is_step = np.zeros(size, dtype=bool)        # True for the start of a step, False for the end of a scan
+        self._bounds_count = 0
+
+    def __len__(self):
+        return self._awn_count
+
+    def add_awn(self, time, awn):
+        """add a real wavenumber received from the laser."""
+        import numpy as np
+        with self._lock:
+            if self._awn_count == self._awn.shape[1]:
+                self._awn = np.concatenate((self._awn, np.zeros_like(self._awn)), axis=1)
+            self._awn[:, self._awn_count] = (time, awn)
+            self._awn_count += 1
+
+    def _add_bound(self, time, step):
+        import numpy as np
+        with self._lock:
+            if self._bounds_count == len(self._bounds):
+                self._bounds = np.concatenate((self._bounds, np.zeros_like(self._bounds)))
+                self._is_step = np.concatenate((self._is_step, np.zeros_like(self._is_step)))
+            self._bounds[self._bounds_count] = time
+            self._is_step[self._bounds_count] = step
+            self._bounds_count += 1
+
+    def add_step(self, time):
+        """add the start of a scan or a step."""
+        self._add_bound(time, True)
+
+    def add_end(self, time):
+        """add the end of a scan."""
+        self._add_bound(time, False)
+
+    def awn(self):
+        """return the times and real wavenumbers of all awn samples (as views on the timeline)."""
+        with self._lock:
+            return self._awn[0, :self._awn_count], self._awn[1, :self._awn_count]
+
+    def _boundaries(self):
+        with self._lock:
+            return self._bounds[:self._bounds_count], self._is_step[:self._bounds_count]
+
+    def steps(self):
+        """return all steps as structured array with start and end time and the wavenumber of each step.
+
+        The wavenumber of a step is the last awn sample before the step ended, i.e. the laser had the maximum time to settle. It is NaN,
+        if no awn was received during the step. The end of the last step is inf, as long as the scan is running.
+        """
+        import numpy as np
+        bounds, is_step = self._boundaries()
+        times, values = self.awn()
+        index = np.flatnonzero(is_step)
+        steps = np.zeros(len(index), dtype=[("start", "f8"), ("end", "f8"), ("wn", "f8")])
+        steps["start"] = bounds[index]
+        steps["end"] = np.append(bounds, np.inf)[index + 1]
+        last = np.searchsorted(times, steps["end"], side="left") - 1
+        valid = (last >= 0) & (times[np.maximum(last, 0)] >= steps["start"]) if len(times) else np.zeros(len(index), dtype=bool)
+        steps["wn"] = np.nan
+        steps["wn"][valid] = values[last[valid]]
+        return steps
+
+    def step_index(self, times):
+        """return the index of the step (see steps) at each of the given times, or -1 before the first step and after the end of a scan."""
+        import numpy as np
+        bounds, is_step = self._boundaries()
+        bound = np.searchsorted(bounds, np.asarray(times, dtype=float), side="right") - 1
+        number = np.cumsum(is_step) - 1
+        inside = bound >= 0
+        inside[inside] = is_step[bound[inside]]
+        return np.where(inside, number[np.maximum(bound, 0)] if len(number) else -1, -1)
+
+    def wavenumber_at(self, times, steps=False, interpolate=False):
+        """return the wavenumber of the laser at each of the given times (NaN, if it is not known).
+
+        By default, the last awn sample received before each time is returned. With interpolate=True the awn samples are interpolated
+        linearly instead (useful for sweeps). With steps=True the wavenumber of the step at each time is returned (useful for stepscans,
+        see steps).
+        """
+        import numpy as np
+        times = np.asarray(times, dtype=float)
+        if steps is True:
+            index = self.step_index(times)
+            wavenumbers = np.append(self.steps()["wn"], np.nan)
+            return wavenumbers[index]                     # index -1 selects the appended NaN
+        sample_times, values = self.awn()
+        if len(sample_times) == 0:
+            return np.full(times.shape, np.nan)
+        if interpolate is True:
+            return np.interp(times, sample_times, values, left=np.nan, right=np.nan)
+        last = np.searchsorted(sample_times, times, side="right") - 1
+        return np.where(last >= 0, values[np.maximum(last, 0)], np.nan)
+
+    def sample_ranges(self, times):
+        """return the first and the last + 1 index of the given (sorted) sample times for each step as array of shape (steps, 2).
+
+        The samples of step n are times[ranges[n, 0]:ranges[n, 1]].
+        """
+        import numpy as np
+        steps = self.steps()
+        times = np.asarray(times, dtype=float)
+        return np.stack((np.searchsorted(times, steps["start"], side="left"), np.searchsorted(times, steps["end"], side="left")), axis=-1)
+
+    def clear(self):
+        """remove all events from the timeline."""
+        with self._lock:
+            self._awn_count = 0
+            self._bounds_count = 0